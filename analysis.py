@@ -0,0 +1,44 @@
+# Histogram-based cost model for the table search in compressor3.py
+# The length of an encoded file only depends on how often each symbol occurs and on the code length of each symbol,
+# so a candidate table can be scored from per-file histograms without encoding anything
+import numpy as np
+
+def code_length_table(freq_table, common_denom=1):
+  # Get the code length in bits of every byte symbol: freq - 1 unary ones, a zero delimiter and the value byte
+  # Keys are byte values divided by the common denominator, so key x codes the byte symbol x * common_denom
+  code_lengths = np.zeros(256, dtype=np.int64) # Symbols without a code cost nothing; the search counts them apart and compress_dir refuses tables that miss any
+  for x, freq in freq_table.items():
+    code_lengths[x * common_denom] = freq + 8
+  return code_lengths
+
+def code_pair(key, freq, row_perm, col_perm, base_size):
+  # Get the (frequency, encoded value) code of a key with the multiplication table given by its row and column permutations
+  # Returns None when the table has no row for the frequency or the value does not fit the single byte it is emitted as
+  if freq > base_size:
+    return None
+  value = (row_perm[freq - 1] + 1) * (col_perm[key % base_size] + 1)
+  return (freq, value) if value <= 0xFF else None
+
+def table_violations(freq_table, row_perm, col_perm, base_size):
+  # Count the keys the tables cannot encode losslessly: keys without a code, which cannot be encoded at all,
+  # and keys whose code repeats another key's, which the decoder turns into that other key
+  # Returns both counts
+  pairs = [code_pair(key, freq, row_perm, col_perm, base_size) for key, freq in freq_table.items()]
+  valid = [pair for pair in pairs if pair is not None]
+  return len(pairs) - len(valid), len(valid) - len(set(valid))
+
+def encoded_bits(histograms, code_lengths):
+  # Get the encoded length in bits of every file
+  return histograms @ code_lengths
+
+def swap_delta(histograms, code_lengths, a, b):
+  # Get the change in encoded bits of every file when symbols a and b exchange their frequencies
+  return (histograms[:, a] - histograms[:, b]) * (code_lengths[b] - code_lengths[a])
+
+def swap_code_lengths(code_lengths, a, b):
+  # Exchange the code lengths of symbols a and b in place, mirroring a swap in the frequency table
+  code_lengths[a], code_lengths[b] = code_lengths[b], code_lengths[a]
+
+def encoded_size(file_bits):
+  # Get the total size in bytes of the encoded files, each padded to a whole byte
+  return int(((file_bits + 7) // 8).sum())
@@ -0,0 +1,224 @@
+# Benchmarks for the hot paths of compressor3.py on generated corpora that look like the data it is used on
+# Every corpus is generated from a fixed seed, one chunk at a time, so the same shape and size always give the same bytes.
+# Each case runs in a fresh process so its peak resident memory is its own, and the results can be saved as a JSON baseline
+# that later runs are compared with
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import compressor3 # The compressor being measured
+import search # Parallel multi-start search for the tables
+import ingest # Streaming, memory-mapped ingestion of the input files
+import tables # Compact C table formats for the header files
+
+# Define constants
+CORPUS_SHAPES = ["text", "sensor", "sparse", "firmware", "gcd"] # Kinds of generated data
+CORPUS_SIZES = {"1K": 1 << 10, "64K": 1 << 16, "1M": 1 << 20, "16M": 1 << 24, "256M": 1 << 28, "1G": 1 << 30} # Sizes by name
+DEFAULT_SIZES = "1K,64K,1M" # Sizes run when none are given; larger ones take minutes
+GENERATE_CHUNK_SIZE = 1 << 20 # Number of bytes generated per chunk, each from its own seed
+PYTHON_LOOP_SIZE = 1 << 20 # Bytes passed to create_freq_table, whose per-element Python loop would take minutes on larger corpora
+BENCH_BASE_SIZE = 15 # Base size of the code table used to time the encoder; its largest product 15 * 15 still fits a byte
+REGRESSION_THRESHOLD = 0.2 # Relative change of a metric past which a run counts as a regression
+BASELINE_FILE = "benchmark_baseline.json" # Default baseline file
+
+# Words the text corpus is made of, drawn with Zipf-like frequencies
+WORDS = ("the of and to in is that for it as was with be by on not he this are or his from at which but have an they you were "
+         "her she there been one all we their has would when if so no will can more other into its time only some could new "
+         "sensor value reading error status firmware table offset buffer packet voltage current").split()
+
+def generate_chunk(shape, rng, start, size):
+  # Generate size bytes of a corpus shape from position start with a seeded generator
+  if shape == "text": # English-like words with spaces and line breaks
+    ranks = np.arange(1, len(WORDS) + 1)
+    indexes = rng.choice(len(WORDS), size // 3 + 1, p=(1 / ranks) / (1 / ranks).sum())
+    separators = np.where(rng.random(len(indexes)) < 0.08, "\n", " ")
+    return np.frombuffer("".join(w + s for w, s in zip(np.array(WORDS)[indexes], separators)).encode()[:size], dtype=np.uint8)
+  if shape == "sensor": # 8-bit ADC readings of a slow oscillation with noise
+    t = np.arange(start, start + size)
+    signal = 128 + 60 * np.sin(2 * np.pi * t / 4096) + 20 * np.sin(2 * np.pi * t / 97) + rng.normal(0, 4, size)
+    return np.clip(signal, 0, 255).astype(np.uint8)
+  if shape == "sparse": # Mostly zero bytes with a few random ones, like padded binaries
+    data = np.zeros(size, dtype=np.uint8)
+    hits = rng.random(size) < 0.02
+    data[hits] = rng.integers(1, 256, int(hits.sum()))
+    return data
+  if shape == "firmware": # Repeated lookup tables with few distinct values and occasional patches
+    table = np.round(31 + 31 * np.sin(2 * np.pi * np.arange(256) / 256)).astype(np.uint8)
+    data = table[np.arange(start, start + size) % 256]
+    patches = rng.random(size) < 0.01
+    data[patches] = rng.integers(0, 64, int(patches.sum()))
+    return data
+  if shape == "gcd": # Values that all share the common denominator 32
+    return (32 * rng.choice(np.arange(1, 8), size, p=[0.3, 0.25, 0.15, 0.1, 0.1, 0.05, 0.05])).astype(np.uint8)
+  raise ValueError(f"Unknown corpus shape {shape!r}, expected one of {CORPUS_SHAPES}")
+
+def write_corpus(path, shape, size, seed=0):
+  # Write a generated corpus to a file one chunk at a time; every chunk has its own seed, so the bytes never depend on memory limits
+  with open(path + ".tmp", "wb") as f:
+    for chunk_index, start in enumerate(range(0, size, GENERATE_CHUNK_SIZE)):
+      rng = np.random.default_rng([seed, CORPUS_SHAPES.index(shape), chunk_index])
+      f.write(generate_chunk(shape, rng, start, min(GENERATE_CHUNK_SIZE, size - start)).tobytes())
+  os.replace(path + ".tmp", path)
+
+def corpus_file(work_dir, shape, size_name, seed=0):
+  # Get the path of a generated corpus, generating it only if it does not exist yet
+  path = os.path.join(work_dir, f"{shape}-{size_name}-{seed}.bin")
+  if not os.path.exists(path):
+    write_corpus(path, shape, CORPUS_SIZES[size_name], seed)
+  return path
+
+def best_time(function, repeat):
+  # Run a function repeat times and return the shortest wall time and the last result
+  best = float("inf")
+  for run in range(repeat):
+    start_time = time.perf_counter()
+    result = function()
+    best = min(best, time.perf_counter() - start_time)
+  return best, result
+
+def bench_tables(histogram):
+  # Build a frequency table and a multiplication table that can encode every symbol of a histogram, for timing the encoder
+  # The codec itself needs every symbol count below the base size, which real corpora rarely satisfy, so the timed table gives
+  # the k-th most frequent symbol the k-th shortest code instead, capped at BENCH_BASE_SIZE
+  present = np.flatnonzero(histogram)
+  ranked = present[np.argsort(-histogram[present], kind="stable")]
+  freq_table = {int(x): min(rank + 1, BENCH_BASE_SIZE) for rank, x in enumerate(ranked)}
+  return freq_table, compressor3.create_mult_table(BENCH_BASE_SIZE)
+
+def run_case(shape, size_name, work_dir, seed=0, repeat=3):
+  # Time every hot path on one corpus and return its metrics
+  path = os.path.abspath(corpus_file(work_dir, shape, size_name, seed))
+  size = os.path.getsize(path)
+  metrics = {}
+
+  # Ingestion: one streaming pass counting every byte
+  seconds, (histogram, order) = best_time(lambda: ingest.scan_file(path), repeat)
+  metrics["ingest"] = {"seconds": seconds, "throughput": size / seconds}
+
+  # create_freq_table runs a Python loop per element, so it is timed on the first PYTHON_LOOP_SIZE bytes
+  with open(path, "rb") as f:
+    sample = list(f.read(PYTHON_LOOP_SIZE))
+  seconds, result = best_time(lambda: compressor3.create_freq_table(sample), repeat)
+  metrics["create_freq_table"] = {"seconds": seconds, "bytes": len(sample), "throughput": len(sample) / seconds}
+
+  # create_mult_table at the base size compress_dir would pick for this corpus
+  total_size, base_size = compressor3.find_base_size(histogram)
+  seconds, mult_table = best_time(lambda: compressor3.create_mult_table(base_size), repeat)
+  metrics["create_mult_table"] = {"seconds": seconds, "base_size": base_size}
+
+  # encode_data over the whole corpus, one ingestion chunk at a time so memory stays bounded
+  freq_table, bench_mult_table = bench_tables(histogram)
+  def encode():
+    return sum(len(compressor3.encode_data(chunk, freq_table, bench_mult_table, BENCH_BASE_SIZE)) for chunk in ingest.read_chunks(path))
+  seconds, encoded_bits = best_time(encode, repeat)
+  metrics["encode_data"] = {"seconds": seconds, "throughput": size / seconds, "ratio": size * 8 / encoded_bits}
+
+  # The compress_dir table search, in one process so iterations per second do not depend on the machine's core count
+  common_denom = ingest.histogram_gcd(histogram)
+  search_table = ingest.freq_table_from_histogram(histogram, order, common_denom)
+  table_size = tables.common_size(search_table, base_size)
+  histograms = histogram.reshape(1, 256)
+  seconds, (ratio, best_freq_table, best_mult_table, ratios, telemetry) = best_time(
+    lambda: search.search_tables(histograms, search_table, base_size, table_size, total_size, max_iter=compressor3.MAX_ITER, workers=1), repeat)
+  iterations = sum(record["event"] == "iteration" for record in telemetry)
+  # The corpora are not shaped to be encodable, so the searched tables may miss or share codes and their ratio is only the cost
+  # model's estimate; it is recorded with the violations but not compared, unlike the encode_data ratio
+  metrics["search"] = {"seconds": seconds, "iterations_per_second": iterations / seconds, "model_ratio": ratio,
+                       "missing": telemetry[-1]["missing"], "collisions": telemetry[-1]["collisions"]}
+
+  # Header writing: the common header from the search result, and the data header streamed from the encoder
+  code_table = compressor3.create_code_table(freq_table, bench_mult_table, BENCH_BASE_SIZE)
+  with tempfile.TemporaryDirectory(dir=work_dir) as header_dir:
+    arrays = tables.common_arrays("common_h", best_freq_table, best_mult_table)
+    seconds, changed = best_time(lambda: compressor3.write_header_file(os.path.join(header_dir, "common.h"), arrays), repeat)
+    metrics["write_header_file"] = {"seconds": seconds}
+    data_header = os.path.join(header_dir, "data.h")
+    def write_data():
+      if os.path.exists(data_header):
+        os.remove(data_header) # Time a full write, not the unchanged-file shortcut
+      encoded_blocks = ((packed, []) for packed in compressor3.encode_file(path, *code_table))
+      return compressor3.write_data_header_file(data_header, encoded_blocks, size)
+    seconds, changed = best_time(write_data, repeat)
+    metrics["write_data_header_file"] = {"seconds": seconds, "throughput": size / seconds}
+
+  metrics["peak_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024) # Kilobytes except on macOS
+  return metrics
+
+def run_benchmarks(shapes, size_names, work_dir, seed=0, repeat=3):
+  # Run every case in its own fresh process and return the metrics by case name
+  results = {}
+  context = multiprocessing.get_context("spawn") # A fresh interpreter, so peak memory is not inherited from earlier cases
+  for size_name in size_names:
+    for shape in shapes:
+      with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        results[f"{shape}-{size_name}"] = executor.submit(run_case, shape, size_name, work_dir, seed, repeat).result()
+  return results
+
+# Metrics compared with the baseline: True for metrics where higher is better, False where lower is better
+# Every benchmark reports seconds, so benchmarks without a throughput, like create_mult_table and write_header_file, are gated too
+COMPARED_METRICS = {"seconds": False, "throughput": True, "iterations_per_second": True, "ratio": True, "peak_rss": False}
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+  # List the metrics that got worse than the baseline by more than threshold, as readable lines
+  regressions = []
+  for case, metrics in results.items():
+    for benchmark, values in metrics.items():
+      values = values if isinstance(values, dict) else {benchmark: values}
+      old_values = baseline.get(case, {}).get(benchmark, {})
+      old_values = old_values if isinstance(old_values, dict) else {benchmark: old_values}
+      for metric, value in values.items():
+        if metric not in COMPARED_METRICS or metric not in old_values:
+          continue
+        old = old_values[metric]
+        change = (value - old) / old if old else 0.0
+        if (change < -threshold) if COMPARED_METRICS[metric] else (change > threshold):
+          name = benchmark if metric == benchmark else f"{benchmark} {metric}"
+          regressions.append(f"{case} {name}: {old:.6g} -> {value:.6g} ({change:+.1%})")
+  return regressions
+
+def main(argv=None):
+  # Run the benchmarks, print the results and compare them with a baseline; exits with status 1 on a regression
+  parser = argparse.ArgumentParser(description="Benchmark the hot paths of compressor3.py on generated corpora")
+  parser.add_argument("--shapes", default=",".join(CORPUS_SHAPES), help="comma separated corpus shapes")
+  parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"comma separated corpus sizes out of {','.join(CORPUS_SIZES)}")
+  parser.add_argument("--seed", type=int, default=0, help="seed of the corpus generator")
+  parser.add_argument("--repeat", type=int, default=3, help="number of runs of every benchmark; the fastest counts")
+  parser.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "compressor3_benchmark"), help="directory for the generated corpora")
+  parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file to compare with or to save")
+  parser.add_argument("--save", action="store_true", help="save the results as the new baseline instead of comparing")
+  parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help="relative change that counts as a regression")
+  args = parser.parse_args(argv)
+
+  shapes, size_names = args.shapes.split(","), args.sizes.split(",")
+  for shape in shapes:
+    if shape not in CORPUS_SHAPES:
+      parser.error(f"unknown corpus shape {shape!r}, expected one of {','.join(CORPUS_SHAPES)}")
+  for size_name in size_names:
+    if size_name not in CORPUS_SIZES:
+      parser.error(f"unknown corpus size {size_name!r}, expected one of {','.join(CORPUS_SIZES)}")
+  os.makedirs(args.work_dir, exist_ok=True)
+
+  results = run_benchmarks(shapes, size_names, args.work_dir, args.seed, args.repeat)
+  print(json.dumps(results, indent=2))
+
+  if args.save:
+    with open(args.baseline, "w") as f:
+      json.dump(results, f, indent=2)
+    return 0
+  if not os.path.exists(args.baseline):
+    print(f"No baseline at {args.baseline}; run with --save to create one", file=sys.stderr)
+    return 0
+  with open(args.baseline) as f:
+    regressions = compare(results, json.load(f), args.threshold)
+  for regression in regressions:
+    print("REGRESSION " + regression, file=sys.stderr)
+  return 1 if regressions else 0
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,164 @@
+# On-disk cache for incremental recompression with compressor3.py
+# Files are identified by a hash of their contents, so an unchanged file is never scanned or encoded twice. Every entry is a group
+# of files named after its key in the cache directory, and the least recently used groups are evicted once the cache grows too big
+import os
+import json
+import hashlib
+import numpy as np
+import ingest # Streaming, memory-mapped ingestion of the input files
+import tables # Compact C table formats for the header files
+
+# Define constants
+CACHE_DIR = ".compressor_cache" # Default cache directory
+CACHE_MAX_BYTES = 256 << 20 # Size above which the least recently used entries are evicted
+
+def digest(*parts):
+  # Hash any number of strings, byte strings and arrays into a short hexadecimal key
+  h = hashlib.blake2b(digest_size=16)
+  for part in parts:
+    data = part.encode() if isinstance(part, str) else np.ascontiguousarray(part).tobytes() if isinstance(part, np.ndarray) else bytes(part)
+    h.update(len(data).to_bytes(8, "little")) # Prefix every part with its length so different splits never collide
+    h.update(data)
+  return h.hexdigest()
+
+def table_digest(freq_table, mult_table, base_size, common_denom):
+  # Hash the parameters that determine every code word: the frequency table, the multiplication table, the base size and the denominator
+  return digest(json.dumps([sorted(freq_table.items()), base_size, common_denom]), np.asarray(mult_table, dtype=np.int64)) # Equal tables in any key order
+
+class Cache:
+  # A size-bounded directory of cache entries, evicted in least recently used order
+
+  def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+    self.total_bytes = None # Size of the cache directory, computed on the first store
+    os.makedirs(cache_dir, exist_ok=True)
+
+  def path(self, key, suffix):
+    # Get the path of one file of an entry
+    return os.path.join(self.cache_dir, key + suffix)
+
+  def hit(self, key, *suffixes):
+    # Check that every file of an entry exists and mark the entry as recently used
+    paths = [self.path(key, suffix) for suffix in suffixes]
+    if not all(os.path.exists(path) for path in paths):
+      return False
+    for path in paths:
+      os.utime(path) # Eviction goes by modification time
+    return True
+
+  def store(self, key, suffix, data):
+    # Write one file of an entry atomically, so an interrupted run never leaves a truncated entry
+    path = self.path(key, suffix)
+    with open(path + ".tmp", "wb") as f:
+      f.write(data)
+    self.commit(path + ".tmp", path)
+
+  def commit(self, tmp_path, path):
+    # Move a finished temporary file into place and evict old entries if the cache grew too big
+    os.replace(tmp_path, path)
+    if self.total_bytes is None:
+      self.total_bytes = sum(entry.stat().st_size for entry in os.scandir(self.cache_dir) if entry.is_file())
+    else:
+      self.total_bytes += os.path.getsize(path)
+    if self.total_bytes > self.max_bytes:
+      self.evict()
+
+  def evict(self):
+    # Remove whole entries, least recently used first, until the cache fits in max_bytes again
+    entries = {}
+    for entry in os.scandir(self.cache_dir):
+      if entry.is_file() and not entry.name.endswith(".tmp"):
+        stat = entry.stat()
+        key = entry.name.split(".")[0]
+        used, size, paths = entries.get(key, (0, 0, []))
+        entries[key] = (max(used, stat.st_mtime_ns), size + stat.st_size, paths + [entry.path])
+    self.total_bytes = sum(size for used, size, paths in entries.values())
+    for key, (used, size, paths) in sorted(entries.items(), key=lambda item: item[1][0]):
+      if self.total_bytes <= self.max_bytes:
+        break
+      for path in paths:
+        os.remove(path)
+      self.total_bytes -= size
+
+  def file_digest(self, path):
+    # Get the content hash of a file, hashing it only when its size or modification time changed since it was last hashed
+    stat = os.stat(path)
+    stat_key = "stat-" + digest(os.path.abspath(path), str(stat.st_size), str(stat.st_mtime_ns), str(stat.st_ino))
+    if self.hit(stat_key, ".txt"):
+      with open(self.path(stat_key, ".txt")) as f:
+        return f.read()
+    h = hashlib.blake2b(digest_size=16)
+    for chunk in ingest.read_chunks(path):
+      h.update(chunk)
+    content_key = h.hexdigest()
+    self.store(stat_key, ".txt", content_key.encode())
+    return content_key
+
+  def scan_file(self, path):
+    # Get the histogram and first occurrence order of a file from ingest.scan_file, scanning only files not seen before
+    # Returns the content hash of the file, its histogram and its order
+    key = "scan-" + self.file_digest(path)
+    if self.hit(key, ".npy"):
+      scan = np.load(self.path(key, ".npy"))
+      return key[5:], scan[:256], scan[256:].tolist()
+    histogram, order = ingest.scan_file(path)
+    with open(self.path(key, ".npy.tmp"), "wb") as f:
+      np.save(f, np.concatenate([histogram, np.array(order, dtype=np.int64)])) # The order follows the 256 histogram counts
+    self.commit(self.path(key, ".npy.tmp"), self.path(key, ".npy"))
+    return key[5:], histogram, order
+
+  def load_search(self, key):
+    # Get a stored search result, or None when the search has not been run with these inputs
+    if not self.hit("search-" + key, ".json"):
+      return None
+    with open(self.path("search-" + key, ".json")) as f:
+      result = json.load(f)
+    freq_table = dict(zip(result["keys"], result["values"]))
+    mult_table = np.outer(np.array(result["rows"]) + 1, np.array(result["cols"]) + 1)
+    return result["ratio"], freq_table, mult_table, result["ratios"], result.get("telemetry", [])
+
+  def store_search(self, key, ratio, freq_table, mult_table, ratios, telemetry):
+    # Store a search result as the frequency table and the row and column permutations of the multiplication table
+    row_perm, col_perm = tables.mult_table_perms(mult_table)
+    result = {"ratio": ratio, "keys": list(freq_table.keys()), "values": list(freq_table.values()),
+              "rows": row_perm.tolist(), "cols": col_perm.tolist(), "ratios": ratios,
+              "telemetry": telemetry}
+    self.store("search-" + key, ".json", json.dumps(result).encode())
+
+  def encoded_blocks(self, key, encoded_blocks):
+    # Get the groups of encoded bytes and block sizes of a file, encoding it only on a cache miss
+    # encoded_blocks is the generator from encode_file or encode_file_blocks; it is only consumed on a miss, and its output is stored as it goes
+    # Block sizes are stored as raw int64 values and read back a chunk at a time, so memory stays bounded for any number of blocks
+    key = "code-" + key
+    if self.hit(key, ".bin", ".sizes"):
+      with open(self.path(key, ".bin"), "rb") as f:
+        for packed in iter(lambda: f.read(ingest.INGEST_CHUNK_SIZE), b""):
+          yield packed, []
+      with open(self.path(key, ".sizes"), "rb") as f:
+        for sizes in iter(lambda: f.read(ingest.INGEST_CHUNK_SIZE), b""):
+          yield b"", np.frombuffer(sizes, dtype=np.int64)
+      return
+    with open(self.path(key, ".bin.tmp"), "wb") as f, open(self.path(key, ".sizes.tmp"), "wb") as sizes_file:
+      for packed, sizes in encoded_blocks:
+        f.write(packed)
+        sizes_file.write(np.asarray(sizes, dtype=np.int64).tobytes())
+        yield packed, sizes
+    self.commit(self.path(key, ".bin.tmp"), self.path(key, ".bin")) # Stored only once the whole file was encoded
+    self.commit(self.path(key, ".sizes.tmp"), self.path(key, ".sizes"))
+
+  def header_key(self, key, filename):
+    # Get the key of the header entry for an encoding key; files with the same contents share the encoding key, so the header name is part of it
+    return "head-" + digest(key, os.path.abspath(filename))
+
+  def header_current(self, key, filename):
+    # Check that a header file exists and still holds the bytes last written for this encoding key
+    head_key = self.header_key(key, filename)
+    if not os.path.exists(filename) or not self.hit(head_key, ".txt"):
+      return False
+    with open(self.path(head_key, ".txt")) as f:
+      return f.read() == self.file_digest(filename)
+
+  def store_header(self, key, filename):
+    # Remember the content hash of the header file written for this encoding key
+    self.store(self.header_key(key, filename), ".txt", self.file_digest(filename).encode())
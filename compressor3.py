@@ -1,14 +1,27 @@
 # Import libraries
 import os
+import sys
 import math
+import functools
+import json
+import argparse
+import filecmp
+import tempfile
 import numpy as np
-import sympy # A library for symbolic mathematics
-import matplotlib.pyplot as plt # A library for plotting
 import bitarray # A library for manipulating bit arrays
+import analysis # Histogram-based cost model for the table search
+import search # Parallel multi-start search for the tables
+import ingest # Streaming, memory-mapped ingestion of the input files
+import decompressor3 # Reference decoder for round-trip verification
+import tables # Compact C table formats for the header files
+import cache # Content-hash cache for incremental recompression
+import telemetry # Phase timers and search telemetry
 
 # Define constants
 MAX_BASE_SIZE = 256 # Maximum size of the custom number base
 MAX_ITER = 100 # Maximum number of iterations for finding the optimal tables
+PACK_BLOCK_SIZE = 1 << 16 # Number of symbols packed per block by the bulk encoder
+CYCLOTOMIC_CACHE_SIZE = 1024 # Number of cyclotomic polynomials whose coefficients are kept
 PROGMEM = "__attribute__((section(\".progmem.data\")))" # Macro for storing data in flash memory
 
 # Define functions
@@ -28,255 +41,437 @@ def create_mult_table(base_size):
       mult_table[i][j] = (i + 1) * (j + 1) # Fill the matrix with the product of the row and column indices plus one
   return mult_table
 
-def encode_data(data, freq_table, mult_table, base_size):
-  # Encode the data using the frequency table, the multiplication table and the base size with variable-length codes
-  encoded_data = bitarray.bitarray() # Initialize an empty bit array to store the encoded data
-  for x in data:
-    freq = freq_table[x] # Get the frequency of the data element
+def create_code_table(freq_table, mult_table, base_size, symbols=None, common_denom=1):
+  # Precompute the code word of every byte symbol once: the unary prefix length (freq - 1) and the encoded value byte
+  # Frequency table keys are byte symbols divided by the common denominator, which the decoder multiplies back
+  prefix_lengths = np.full(256, -1, dtype=np.int64) # Unary prefix length per symbol, -1 for symbols without a code
+  code_values = np.zeros(256, dtype=np.uint8) # Encoded value byte per symbol
+  if symbols is None: # By default build codes for every byte symbol present in the frequency table
+    symbols = [x * common_denom for x in freq_table if x * common_denom < 256]
+  for x in symbols:
+    x = int(x)
+    if x % common_denom: # Only multiples of the common denominator have a key
+      raise KeyError(x)
+    key = x // common_denom
+    freq = freq_table[key] # Get the frequency of the data element
     mult = mult_table[freq - 1] # Get the corresponding row in the multiplication table
-    encoded_value = mult[x % base_size] # Get the encoded value from the multiplication table
-    
-    # Convert the encoded value to a variable-length binary code using unary coding for the frequency and binary coding for the modulo
-    encoded_bits = bitarray.bitarray() # Initialize an empty bit array to store the encoded bits
-    encoded_bits.extend('1' * (freq - 1)) # Append freq - 1 ones to represent the frequency using unary coding
-    encoded_bits.append('0') # Append a zero as a delimiter between the frequency and the modulo
-    encoded_bits.frombytes(encoded_value.to_bytes(1, 'big')) # Append the modulo as a byte using binary coding
-    
-    # Append the encoded bits to the encoded data bit array
-    encoded_data.extend(encoded_bits)
-  
+    encoded_value = int(mult[key % base_size]) # Get the encoded value from the multiplication table
+    encoded_value.to_bytes(1, 'big') # The value is emitted as a single byte, so reject values that do not fit
+    prefix_lengths[x] = freq - 1
+    code_values[x] = encoded_value
+  return prefix_lengths, code_values
+
+def create_code_words(prefix_lengths, code_values):
+  # Turn a code table into one right aligned code word and code length per symbol, for codes that fit in a machine word
+  code_lengths = (prefix_lengths.clip(0) + 9).astype(np.uint64) # Total code length per symbol
+  code_words = ((np.uint64(1) << code_lengths) - np.uint64(512)) | code_values # Unary ones above the delimiter and value byte
+  return code_words, code_lengths
+
+def pack_words(lengths, words):
+  # Pack codes that fit in a 64-bit word by OR-ing every code into the output words it overlaps
+  ends = np.cumsum(lengths)
+  total_bits = int(ends[-1])
+  starts = ends - lengths # Bit position of the first bit of every code
+  word_index = starts >> np.uint64(6) # Output word holding the first bit of every code
+  tail = (starts & np.uint64(63)) + lengths # Bit position just past the code, relative to that word
+
+  # Left align each code inside its word; codes crossing a word boundary keep their head here and spill the rest
+  heads = words << (np.uint64(64) - tail) # Wraps around for spilling codes, which are fixed up below
+  spills = np.flatnonzero(tail > 64)
+  heads[spills] = words[spills] >> (tail[spills] - np.uint64(64))
+
+  # Codes never overlap, so the codes sharing a word combine with a segmented OR
+  packed = np.zeros(((total_bits + 63) >> 6) + 1, dtype=np.uint64)
+  firsts = np.flatnonzero(np.diff(word_index, prepend=np.uint64(1 << 63)))
+  packed[word_index[firsts]] = np.bitwise_or.reduceat(heads, firsts)
+  packed[word_index[spills] + np.uint64(1)] |= words[spills] << (np.uint64(128) - tail[spills])
+  return packed.byteswap().tobytes()[:(total_bits + 7) >> 3], total_bits
+
+def pack_bits(symbols, prefix_lengths, code_values):
+  # Pack symbols with codes of any length by building the bit stream one bit per byte
+  prefixes = prefix_lengths[symbols] # Unary prefix length of every symbol
+  ends = np.cumsum(prefixes + 9) # Each code is the unary prefix, a zero delimiter and one value byte
+  total_bits = int(ends[-1])
+  delimiters = ends - 9 # Bit position of the zero delimiter of every code
+
+  # Mark the start and the end of every unary run and integrate to get the run of ones in front of each delimiter
+  bits = np.zeros(total_bits, dtype=np.int8)
+  bits[delimiters - prefixes] = 1
+  bits[delimiters] -= 1
+  np.cumsum(bits, out=bits)
+
+  # Scatter the eight value bits of every code behind its delimiter, most significant bit first
+  value_bits = np.unpackbits(code_values[symbols][:, None], axis=1)
+  bits[(delimiters + 1)[:, None] + np.arange(8)] = value_bits
+  return np.packbits(bits.view(np.uint8)).tobytes(), total_bits
+
+def check_codes(symbols, prefix_lengths):
+  # Raise KeyError for the first symbol of a uint8 symbol array that has no code in the code table, as encode_data does
+  missing = np.flatnonzero(prefix_lengths[symbols] < 0)
+  if len(missing):
+    raise KeyError(int(symbols[missing[0]]))
+
+def pack_codes(symbols, prefix_lengths, code_values):
+  # Pack a uint8 symbol array into a bit array in bulk using a code table from create_code_table
+  encoded_data = bitarray.bitarray() # Initialize an empty bit array to store the encoded data
+  if len(symbols) == 0:
+    return encoded_data
+  check_codes(symbols, prefix_lengths) # Symbols without a code would otherwise pack as a zero value byte
+  code_words, code_lengths = create_code_words(prefix_lengths, code_values)
+  fits_word = code_lengths[prefix_lengths >= 0].max() <= 64 # All codes fit in a machine word, use the word packer
+
+  # Pack in fixed-size blocks so the temporaries stay cache sized, then join the blocks at bit granularity
+  for i in range(0, len(symbols), PACK_BLOCK_SIZE):
+    block_symbols = symbols[i:i + PACK_BLOCK_SIZE]
+    if fits_word:
+      packed, total_bits = pack_words(code_lengths[block_symbols], code_words[block_symbols])
+    else: # Long unary prefixes, fall back to the bit packer
+      packed, total_bits = pack_bits(block_symbols, prefix_lengths, code_values)
+    block = bitarray.bitarray()
+    block.frombytes(packed)
+    del block[total_bits:] # Drop the padding so the bit length matches the encoded codes
+    encoded_data.extend(block)
   return encoded_data
 
-def write_header_file(filename, data, progmem=True):
-  # Write a header file with the given filename and data
-  with open(filename, "w") as f:
-    f.write("#ifndef " + filename.upper().replace(".", "_") + "\n") # Write the header guard
-    f.write("#define " + filename.upper().replace(".", "_") + "\n\n")
-    if progmem: # If storing data in flash memory
-      f.write(PROGMEM + "\n") # Write the PROGMEM macro
-    f.write("const int " + filename.replace(".", "_") + "[] = {") # Write the array declaration
-    for i, x in enumerate(data):
-      f.write(str(x)) // str(x).denominator() if isinstance(str(x),sympy.Rational) else str(x) 
-# Write each element of the data and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-      if i < len(data) - 1:
-        f.write(", ") // ", ".denominator() if isinstance(", ",sympy.Rational) else ", " 
-# Write a comma separator if not the last element and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-    f.write("};\n\n") // "};\n\n".denominator() if isinstance("};\n\n",sympy.Rational) else "};\n\n" 
-# Write the array closing bracket and a new line and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-    f.write("#endif\n") // "#endif\n".denominator() if isinstance("#endif\n",sympy.Rational) else "#endif\n" 
-# Write the header guard closing statement and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
+def pack_blocks(symbols, prefix_lengths, code_values, block_size):
+  # Pack a uint8 symbol array as independently decodable blocks of block_size symbols, each padded to a whole byte
+  # Returns the packed bytes and the encoded size in bytes of every block
+  if len(symbols) == 0:
+    return b"", np.zeros(0, dtype=np.int64)
+  check_codes(symbols, prefix_lengths)
+  code_words, code_lengths = create_code_words(prefix_lengths, code_values)
+  if code_lengths[prefix_lengths >= 0].max() > 57: # Codes plus up to seven padding bits no longer fit a machine word
+    packed = [pack_codes(symbols[i:i + block_size], prefix_lengths, code_values).tobytes() for i in range(0, len(symbols), block_size)]
+    return b"".join(packed), np.array([len(block) for block in packed], dtype=np.int64)
+
+  # Blocks end on byte boundaries, so groups of whole blocks are packed separately and simply concatenated
+  group_size = block_size * max(1, PACK_BLOCK_SIZE // block_size)
+  packed, block_bytes = [], []
+  for i in range(0, len(symbols), group_size):
+    group = symbols[i:i + group_size]
+    lengths = code_lengths[group]
+    words = code_words[group]
+
+    # Pad the last code of every block with zeros up to the next byte boundary
+    block_bits = np.add.reduceat(lengths, np.arange(0, len(group), block_size)).astype(np.int64)
+    padding = (-block_bits % 8).astype(np.uint64)
+    last = np.minimum(np.arange(block_size, len(group) + block_size, block_size), len(group)) - 1
+    words[last] <<= padding
+    lengths[last] += padding
+
+    packed.append(pack_words(lengths, words)[0])
+    block_bytes.append((block_bits + 7) // 8)
+  return b"".join(packed), np.concatenate(block_bytes)
+
+def encode_data(data, freq_table, mult_table, base_size):
+  # Encode the data using the frequency table, the multiplication table and the base size with variable-length codes
+  # Every symbol becomes freq - 1 ones (unary coding for the frequency), a zero delimiter and the encoded value byte
+  if isinstance(data, (bytes, bytearray, memoryview)):
+    symbols = np.frombuffer(data, dtype=np.uint8)
+  else:
+    symbols = np.asarray(data, dtype=np.uint8)
+  present = np.flatnonzero(np.bincount(symbols, minlength=256)) # Only the symbols that occur need a code
+  try:
+    prefix_lengths, code_values = create_code_table(freq_table, mult_table, base_size, present)
+  except (KeyError, IndexError, OverflowError):
+    # Rebuild in order of first occurrence so the error raised is the one for the first element that cannot be encoded
+    _, first_index = np.unique(symbols, return_index=True)
+    create_code_table(freq_table, mult_table, base_size, symbols[np.sort(first_index)])
+    raise
+  return pack_codes(symbols, prefix_lengths, code_values)
+
+def encode_file(path, prefix_lengths, code_values, chunk_size=ingest.INGEST_CHUNK_SIZE):
+  # Encode a file in fixed-size blocks with a code table from create_code_table and yield the encoded bytes as they fill up
+  # The concatenated output equals encode_data(...).tobytes() on the whole file
+  pending = bitarray.bitarray() # Encoded bits that do not fill a whole byte yet
+  for chunk in ingest.read_chunks(path, chunk_size):
+    pending.extend(pack_codes(chunk, prefix_lengths, code_values))
+    whole_bits = len(pending) - len(pending) % 8
+    yield pending[:whole_bits].tobytes()
+    del pending[:whole_bits]
+  yield pending.tobytes() # Pad the last byte with zeros
+
+def encode_file_blocks(path, prefix_lengths, code_values, block_size):
+  # Encode a file as independently decodable blocks of block_size symbols, each padded to a whole byte
+  # Yields the encoded bytes and the encoded size in bytes of every block, one group of blocks at a time
+  chunk_size = block_size * max(1, ingest.INGEST_CHUNK_SIZE // block_size) # Read whole blocks per chunk
+  for chunk in ingest.read_chunks(path, chunk_size):
+    yield pack_blocks(chunk, prefix_lengths, code_values, block_size)
 
+def replace_if_changed(tmp_filename, filename):
+  # Move a freshly written file over filename only when their bytes differ, so build tools do not see unchanged headers as modified
+  # Returns whether filename changed
+  if os.path.exists(filename) and filecmp.cmp(tmp_filename, filename, shallow=False):
+    os.remove(tmp_filename)
+    return False
+  os.replace(tmp_filename, filename)
+  return True
+
+def write_header_file(filename, arrays, defines=None, progmem=True):
+  # Write a header file with the given filename, defines and arrays in one buffered write
+  # Every array is declared with the narrowest C integer type that holds its values. Returns whether the file changed
+  guard = os.path.basename(filename).upper().replace(".", "_") # Identifiers come from the file name alone, wherever the file is written
+  text = ["#ifndef " + guard + "\n", "#define " + guard + "\n\n", "#include <stdint.h>\n\n"] # Write the header guard
+  if defines:
+    text += [tables.format_define(name, value) for name, value in defines.items()] + ["\n"] # Write each define
+  text += [tables.format_array(name, values, progmem, PROGMEM) for name, values in arrays.items()] # Write each array
+  text.append("#endif\n") # Write the header guard closing statement
+  with open(filename + ".tmp", "w") as f:
+    f.write("".join(text))
+  return replace_if_changed(filename + ".tmp", filename)
+
+def write_data_header_file(filename, encoded_blocks, length, block_size=None, progmem=True):
+  # Write the header file of an encoded file from the groups of encoded bytes and block sizes yielded by encode_file_blocks
+  # The data array is written one group at a time and the block index goes through a temporary file, so memory stays bounded for any
+  # number of blocks. The header holds the number of decoded bytes, and in block mode also the block size and an index with the start
+  # byte of every block followed by the total, so block k is data[index[k]:index[k + 1]]
+  # Returns whether the file changed
+  name = os.path.basename(filename).replace(".", "_") # Identifiers come from the file name alone, wherever the file is written
+  guard = name.upper()
+  index_file = tempfile.TemporaryFile() if block_size is not None else None # The block index is spilled to disk, one int64 per block
+  end = 0 # Start byte of the next block
+  with open(filename + ".tmp", "w") as f:
+    head = ["#ifndef " + guard + "\n", "#define " + guard + "\n\n", "#include <stdint.h>\n\n"] # Write the header guard
+    head.append(tables.format_define(guard + "_LENGTH", length)) # Number of decoded bytes in the file
+    if block_size is not None:
+      head.append(tables.format_define(guard + "_BLOCK_SIZE", block_size)) # Number of decoded bytes per block
+    head.append("\n" + (PROGMEM + "\n" if progmem else "") + "const uint8_t " + name + "[] = {") # Write the data array declaration
+    f.write("".join(head))
+    written = 0
+    for packed, block_bytes in encoded_blocks:
+      if len(packed) > 0:
+        f.write((", " if written else "") + tables.format_values(np.frombuffer(packed, dtype=np.uint8))) # Write a group of elements at once
+        written += len(packed)
+      if index_file is not None and len(block_bytes):
+        starts = end + np.cumsum(np.asarray(block_bytes, dtype=np.int64))
+        index_file.write(starts.tobytes())
+        end = int(starts[-1])
+    f.write("};\n\n") # Write the array closing bracket and a new line
+    if index_file is not None: # Write the block index, which starts at 0 and rises to the end offset, so the end offset sets its type
+      f.write((PROGMEM + "\n" if progmem else "") + "const " + tables.narrowest_type([end])[0] + " " + name + "_index[] = {0")
+      index_file.seek(0)
+      for chunk in iter(lambda: index_file.read(ingest.INGEST_CHUNK_SIZE), b""):
+        f.write(", " + tables.format_values(np.frombuffer(chunk, dtype=np.int64)))
+      f.write("};\n\n")
+      index_file.close()
+    f.write("#endif\n") # Write the header guard closing statement
+  return replace_if_changed(filename + ".tmp", filename)
+
+@functools.lru_cache(maxsize=CYCLOTOMIC_CACHE_SIZE)
 def cyclotomic_poly(n):
-  # Return the n-th cyclotomic polynomial as a sympy expression
-  x = sympy.Symbol('x') // sympy.Symbol('x').denominator() if isinstance(sympy.Symbol('x'),sympy.Rational) else sympy.Symbol('x') 
-# Define a symbol for x and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-phi = sympy.polys.polytools.cyclotomic_poly(n, x) // sympy.polys.polytools.cyclotomic_poly(n, x).denominator() if isinstance(sympy.polys.polytools.cyclotomic_poly(n, x),sympy.Rational) else sympy.polys.polytools.cyclotomic_poly(n, x) 
-# Calculate the cyclotomic polynomial using sympy function and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-return phi
+  # Return the integer coefficients of the n-th cyclotomic polynomial, highest degree first
+  # The coefficients are built with sympy only the first time n is seen; sympy is imported here so nothing else pays for it
+  import sympy # A library for symbolic mathematics
+  phi = sympy.cyclotomic_poly(n, sympy.Symbol('x'), polys=True) # Calculate the cyclotomic polynomial using sympy function
+  return tuple(int(c) for c in phi.all_coeffs()) # Cyclotomic polynomials are monic with integer coefficients
 
 def evaluate_poly(poly, x):
-  # Evaluate a polynomial at a given value of x and return an integer result
-  result = poly.subs(sympy.Symbol('x'), x) // poly.subs(sympy.Symbol('x'), x).denominator() if isinstance(poly.subs(sympy.Symbol('x'), x),sympy.Rational) else int(poly.subs(sympy.Symbol('x'), x)) 
-# Convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-return result
+  # Evaluate a polynomial given by its integer coefficients at an integer or an array of integers with Horner's rule
+  # Arrays are evaluated in one vectorized pass, in int64 when the result provably fits and with Python integers otherwise
+  values = np.asarray(x)
+  elements = values.ravel().tolist() # Python integers, so values beyond 64 bits are handled too
+  if values.dtype.kind not in "iuO" or not all(isinstance(v, int) and not isinstance(v, bool) for v in elements): # Never truncate floats silently
+    raise TypeError(f"Polynomials are evaluated at integers only, got {values.dtype} values")
+  largest = max((abs(v) for v in elements), default=0)
+  bound = sum(abs(c) for c in poly) * max(1, largest) ** max(0, len(poly) - 1) # Bound on every intermediate result
+  values = values.astype(np.int64 if bound < 1 << 63 else object)
+  result = np.zeros_like(values)
+  for c in poly:
+    result = result * values + c
+  return int(result) if values.ndim == 0 else result
 
-def compress_dir(dir_name):
+def find_base_size(corpus_histogram):
+  # Find the optimal base size using heuristics based on data size and variability
+  # Returns the total size of the data and the base size
+  total_size, max_value, min_value, mean_value, std_value = ingest.histogram_stats(corpus_histogram) # Get the total size, maximum, minimum, mean and standard deviation of all data
+  range_value = max_value - min_value + 1 # Get the range of values of all data elements
+
+  base_size = min(MAX_BASE_SIZE, range_value) # Initialize the base size as the minimum of MAX_BASE_SIZE and range_value
+  if std_value < mean_value / 2: # If the data is not very variable
+    base_size = min(base_size, mean_value + std_value) # Reduce the base size to the mean value plus the standard deviation
+  if base_size > total_size / 4: # If the base size is too large compared to the total size
+    base_size = max(2, total_size // 4) # Reduce the base size to a quarter of the total size or 2, whichever is larger
+  return total_size, int(base_size) # Convert the base size to an integer
+
+def compress_dir(dir_name, strategy="hill_climb", restarts=search.SEARCH_RESTARTS, seed=0, time_limit=None, workers=None, block_size=None, verify=False,
+                 cache_dir=None, cache_max_bytes=cache.CACHE_MAX_BYTES, hooks=None, out_dir=".", max_iter=MAX_ITER,
+                 trace_memory=False):
   # Compress all files in a given directory using the custom number base compression algorithm with cyclotomic polynomial analysis and visualization of iterative search process
-  
-  files = os.listdir(dir_name) // os.listdir(dir_name).denominator() if isinstance(os.listdir(dir_name),sympy.Rational) else os.listdir(dir_name) 
-# Get all files in the directory and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-  
-  
-data_list = [] // [].denominator() if isinstance([],sympy.Rational) else [] 
-# Initialize an empty list to store all data from all files and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-  
-for file in files:
-    
-with open(os.path.join(dir_name, file), "rb") as f:
-      
-data = list(f.read()) // list(f.read()).denominator() if isinstance(list(f.read()),sympy.Rational) else list(f.read()) 
-# Read the file as bytes and convert to a list of integers and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-      
-data_list.append(data) // data_list.append(data).denominator() if isinstance(data_list.append(data),sympy.Rational) else data_list.append(data) 
-# Append the data list to the data list list and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-  
-  
-
-# Find the optimal base size using heuristics based on data size and variability
-  
-total_size = sum([len(data) for data in data_list]) // sum([len(data) for data in data_list]).denominator() if isinstance(sum([len(data) for data in data_list]),sympy.Rational) else sum([len(data) for data in data_list]) 
-# Get the total size of all data in bytes and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-max_value = max([max(data) for data in data_list]) // max([max(data) for data in data_list]).denominator() if isinstance(max([max(data) for data in data_list]),sympy.Rational) else max([max(data) for data in data_list]) 
-# Get the maximum value of all data elements and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-min_value = min([min(data) for data in data_list]) // min([min(data) for data in data_list]).denominator() if isinstance(min([min(data) for data in data_list]),sympy.Rational) else min([min(data) for data in data_list]) 
-# Get the minimum value of all data elements and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-range_value = max_value - min_value + 1 // (max_value - min_value + 1).denominator() if isinstance(max_value - min_value + 1,sympy.Rational) else max_value - min_value + 1 
-# Get the range of values of all data elements and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-mean_value = sum([sum(data) for data in data_list]) / total_size // (sum([sum(data) for data in data_list]) / total_size).denominator() if isinstance(sum([sum(data) for data in data_list]) / total_size,sympy.Rational) else sum([sum(data) for data in data_list]) / total_size 
-# Get the mean value of all data elements and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-std_value = math.sqrt(sum([sum([(x - mean_value)**2 for x in data]) for data in data_list]) / total_size) // (math.sqrt(sum([sum([(x - mean_value)**2 for x in data]) for data in data_list]) / total_size)).denominator() if isinstance(math.sqrt(sum([sum([(x - mean_value)**2 for x in data]) for data in data_list]) / total_size),sympy.Rational) else math.sqrt(sum([sum([(x - mean_value)**2 for x in data]) for data in data_list]) / total_size) 
-# Get the standard deviation of all data elements and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-  
-  
-base_size = min(MAX_BASE_SIZE, range_value) // (min(MAX_BASE_SIZE, range_value)).denominator() if isinstance(min(MAX_BASE_SIZE, range_value),sympy.Rational) else min(MAX_BASE_SIZE, range_value) 
-# Initialize the base size as the minimum of MAX_BASE_SIZE and range_value and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-  
-  
-if std_value < mean_value / 2: // (mean_value / 2).denominator() if isinstance(mean_value / 2,sympy.Rational) else mean_value / 2 
-# If the data is not very variable
-    
-base_size = min(base_size, mean_value + std_value) // (min(base_size, mean_value + std_value)).denominator() if isinstance(min(base_size, mean_value + std_value),sympy.Rational) else min(base_size, mean_value + std_value) 
-# Reduce the base size to the mean value plus the standard deviation and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-  
-  
-if base_size > total_size / 4: // (total_size / 4).denominator() if isinstance(total_size / 4,sympy.Rational) else total_size / 4 
-# If the base size is too large compared to the total size
-    
-base_size = max(2, total_size // 4) // (max(2, total_size // 4)).denominator() if isinstance(max(2, total_size // 4),sympy.Rational) else max(2, total_size // 4) 
-# Reduce the base size to a quarter of the total size or 2, whichever is larger and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-  
-  
-base_size = int(base_size) // int(base_size).denominator() if isinstance(int(base_size),sympy.Rational) else int(base_size) 
-# Convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-  
-  
-# Initialize a common frequency table and a common denominator for all data
-  
-freq_table, common_denom = create_freq_table([x for data in data_list for x in data])
-  
-  
-# Initialize a custom multiplication table for the base size
-  
-mult_table = create_mult_table(base_size)
-  
-  
-# Initialize a variable to store the best compression ratio
-  
-best_ratio = 0
-  
-  
-# Initialize a list to store the compression ratios for each iteration
-  
-ratios = []
-  
-  
-# Iterate over a number of trials to find the optimal frequency table and multiplication table using a hill-climbing algorithm
-  
-current_freq_table = freq_table.copy() // freq_table.copy().denominator() if isinstance(freq_table.copy(),sympy.Rational) else freq_table.copy() 
-# Copy the initial frequency table and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-current_mult_table = mult_table.copy() // mult_table.copy().denominator() if isinstance(mult_table.copy(),sympy.Rational) else mult_table.copy() 
-# Copy the initial multiplication table and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-  
-for i in range(MAX_ITER):
-    
-
-# Choose a random neighbor of the current frequency table and multiplication table by swapping two keys or values in the frequency table or two rows or columns in the multiplication table
-    
-neighbor_freq_table = current_freq_table.copy() // current_freq_table.copy().denominator() if isinstance(current_freq_table.copy(),sympy.Rational) else current_freq_table.copy() 
-# Copy the current frequency table and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-neighbor_mult_table = current_mult_table.copy() // current_mult_table.copy().denominator() if isinstance(current_mult_table.copy(),sympy.Rational) else current_mult_table.copy() 
-# Copy the current multiplication table and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-    
-choice = random.randint(1, 4) // random.randint(1, 4).denominator() if isinstance(random.randint(1, 4),sympy.Rational) else random.randint(1, 4) 
-# Choose a random number between 1 and 4 to decide which part of the tables to swap and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-    
-if choice == 1: // 1.denominator() if isinstance(1,sympy.Rational) else 1 
-# Swap two keys in the frequency table
-      
-keys = list(neighbor_freq_table.keys()) // list(neighbor_freq_table.keys()).denominator() if isinstance(list(neighbor_freq_table.keys()),sympy.Rational) else list(neighbor_freq_table.keys()) 
-# Get the keys of the frequency table and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-      
-i, j = random.sample(range(len(keys)), 2) // random.sample(range(len(keys)), 2).denominator() if isinstance(random.sample(range(len(keys)), 2),sympy.Rational) else random.sample(range(len(keys)), 2) 
-# Choose two random indices from the keys list and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-      
-keys[i], keys[j] = keys[j], keys[i] // (keys[j], keys[i]).denominator() if isinstance((keys[j], keys[i]),sympy.Rational) else (keys[j], keys[i]) 
-# Swap the keys at those indices and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-      
-neighbor_freq_table = dict(zip(keys, neighbor_freq_table.values())) // dict(zip(keys, neighbor_freq_table.values())).denominator() if isinstance(dict(zip(keys, neighbor_freq_table.values())),sympy.Rational) else dict(zip(keys, neighbor_freq_table.values())) 
-# Create a new frequency table with the swapped keys and the same values and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-    
-elif choice == 2: // 2.denominator() if isinstance(2,sympy.Rational) else 2 
-# Swap two values in the frequency table
-      
-values = list(neighbor_freq_table.values()) // list(neighbor_freq_table.values()).denominator() if isinstance(list(neighbor_freq_table.values()),sympy.Rational) else list(neighbor_freq_table.values()) 
-# Get the values of the frequency table and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-      
-i, j = random.sample(range(len(values)), 2) // random.sample(range(len(values)), 2).denominator() if isinstance(random.sample(range(len(values)), 2),sympy.Rational) else random.sample(range(len(values)), 2) 
-# Choose two random indices from the values list and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-      
-values[i], values[j] = values[j], values[i] // (values[j], values[i]).denominator() if isinstance((values[j], values[i]),sympy.Rational) else (values[j], values[i]) 
-# Swap the values at those indices and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-      
-neighbor_freq_table = dict(zip(neighbor_freq_table.keys(), values)) // dict(zip(neighbor_freq_table.keys(), values)).denominator() if isinstance(dict(zip(neighbor_freq_table.keys(), values)),sympy.Rational) else dict(zip(neighbor_freq_table.keys(), values)) 
-# Create a new frequency table with the same keys and the swapped values and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-    
-elif choice == 3: // 3.denominator() if isinstance(3,sympy.Rational) else 3 
-# Swap two rows in the multiplication table
-      
-i, j = random.sample(range(base_size), 2) // random.sample(range(base_size), 2).denominator() if isinstance(random.sample(range(base_size), 2),sympy.Rational) else random.sample(range(base_size), 2) 
-# Choose two random indices from the range of base size and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-      
-neighbor_mult_table[[i, j]] = neighbor_mult_table[[j, i]] // neighbor_mult_table[[j, i]].denominator() if isinstance(neighbor_mult_table[[j, i]],sympy.Rational) else neighbor_mult_table[[j, i]] 
-# Swap the rows at those indices and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-    
-else: // else.denominator() if isinstance(else,sympy.Rational) else else 
-# Swap two columns in the multiplication table
-      
-i, j = random.sample(range(base_size), 2) // random.sample(range(base_size), 2).denominator() if isinstance(random.sample(range(base_size), 2),sympy.Rational) else random.sample(range(base_size), 2) 
-# Choose two random indices from the range of base size and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-      
-neighbor_mult_table[:, [i, j]] = neighbor_mult_table[:, [j, i]] // neighbor_mult_table[:, [j, i]].denominator() if isinstance(neighbor_mult_table[:, [j, i]],sympy.Rational) else neighbor_mult_table[:, [j, i]] 
-# Swap the columns at those indices and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-    
-# Encode each file data using the neighbor frequency table, the neighbor multiplication table and the base size with variable-length codes
-    
-encoded_data_list = [encode_data(data, neighbor_freq_table, neighbor_mult_table, base_size) for data in data_list]
-    
-# Calculate the compression ratio for this trial
-    
-compressed_size = sum([encoded_data.length() // 8 + (1 if encoded_data.length() % 8 else 0) for encoded_data in encoded_data_list]) + len(neighbor_freq_table) * 2 + base_size * base_size + 2
-    compression_ratio = total_size / compressed_size
-    
-# Append the compression ratio to the ratios list
-    
-ratios.append(compression_ratio)
-    
-# If the compression ratio is better than or equal to the current ratio, update the current ratio and the current frequency table and multiplication table
-    
-if compression_ratio >= best_ratio:
-      
-best_ratio = compression_ratio
-      
-current_freq_table = neighbor_freq_table.copy() // neighbor_freq_table.copy().denominator() if isinstance(neighbor_freq_table.copy(),sympy.Rational) else neighbor_freq_table.copy() 
-# Copy the neighbor frequency table and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-current_mult_table = neighbor_mult_table.copy() // neighbor_mult_table.copy().denominator() if isinstance(neighbor_mult_table.copy(),sympy.Rational) else neighbor_mult_table.copy() 
-# Copy the neighbor multiplication table and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-  
-  
-# Write the best frequency table, the common denominator, the best multiplication table and the base size to a header file
-  
-write_header_file("common.h", [common_denom, base_size] + list(current_freq_table.keys()) + list(current_freq_table.values()) + list(current_mult_table.flatten()))
-  
-  
-# Write each encoded file data to a separate header file using the best frequency table and multiplication table with variable-length codes
-  
-for i, encoded_data in enumerate(encoded_data_list):
-  write_header_file(files[i] + ".h", encoded_data.tobytes()) // encoded_data.tobytes().denominator() if isinstance(encoded_data.tobytes(),sympy.Rational) else encoded_data.tobytes() 
-# Convert the bit array to bytes and write to the header file and convert rational results to integers by dividing numerator by denominator and then convert to integer. Convert other results to integers directly.
-  
-# Return the best compression ratio
-return best_ratio, ratios
-
-# Test the compression algorithm on a sample directory
-dir_name = "sample_dir"
-compression_ratio, ratios = compress_dir(dir_name)
-
-# Print the compression ratio
-print(f"Compression ratio: {compression_ratio:.2f}")
-
-# Plot the compression ratios for each iteration
-plt.plot(ratios)
-plt.xlabel("Iteration")
-plt.ylabel("Compression ratio")
-plt.title("Compression ratio vs. iteration")
-plt.show()
+  # The table search runs the given strategy from search.SEARCH_STRATEGIES with a fixed seed, so runs with the same arguments give identical output
+  # Every restart runs up to max_iter iterations and stops at the time_limit; with max_iter None and a time_limit the search runs for the whole time
+  # With a block_size each file is split into independently decodable blocks of block_size bytes with an index for random access
+  # With verify every written header file is decoded again and compared with its original file, and a verify record with the
+  # decode time and throughput of every file goes to the hooks
+  # With a cache_dir, unchanged files are neither scanned nor encoded again, and header files are only rewritten when their bytes change
+  # Every hook is called with the telemetry records: the wall time and peak memory of every phase and every iteration of the search
+  # With trace_memory the phases also report the memory allocated by Python objects, which slows them down (see telemetry.phase)
+  # The header files are written to out_dir, which is created if needed
+
+  files = sorted(os.listdir(dir_name)) # Get all files in the directory, in an order that does not depend on the filesystem
+  file_cache = cache.Cache(cache_dir, cache_max_bytes) if cache_dir is not None else None
+
+  # Scan every file in fixed-size chunks, keeping only its histogram and the order in which its symbols first occur
+  with telemetry.phase(hooks, "ingest", trace_memory=trace_memory):
+    if file_cache is None:
+      scans = [(None,) + ingest.scan_file(os.path.join(dir_name, file)) for file in files]
+    else:
+      scans = [file_cache.scan_file(os.path.join(dir_name, file)) for file in files]
+    content_keys = [content_key for content_key, histogram, order in scans]
+    histograms = np.array([histogram for content_key, histogram, order in scans], dtype=np.int64).reshape(-1, 256)
+    orders = [order for content_key, histogram, order in scans]
+    corpus_histogram = histograms.sum(axis=0)
+
+  # Find the optimal base size using heuristics based on data size and variability
+  with telemetry.phase(hooks, "stats", trace_memory=trace_memory):
+    total_size, base_size = find_base_size(corpus_histogram)
+
+  # Initialize a common frequency table and a common denominator for all data
+  with telemetry.phase(hooks, "freq_table", trace_memory=trace_memory):
+    common_denom = ingest.histogram_gcd(corpus_histogram)
+    # Keys go in ascending order, so the search and its tables only depend on the histograms: reordering bytes inside a file
+    # re-encodes that file only, while any change to the histograms changes the tables and re-encodes every file
+    freq_table = ingest.freq_table_from_histogram(corpus_histogram, np.flatnonzero(corpus_histogram).tolist(), common_denom)
+    max_freq = max(freq_table.values())
+    if max_freq > base_size: # Swaps only move frequencies between keys, so no search can give this frequency a row
+      raise ValueError(f"A data element occurs {max_freq} times but the multiplication table only has rows for up to {base_size}, so the data cannot be encoded")
+
+    # The encoded length of a file only depends on its histogram and the code lengths, so the search never reads the files again
+    table_size = tables.common_size(freq_table, base_size) # Serialized size of the common header, which no swap changes
+    if block_size is not None: # Add the block padding and the block indexes, which no swap changes much either
+      encoded_bytes = (analysis.encoded_bits(histograms, analysis.code_length_table(freq_table, common_denom)) + 7) // 8
+      for histogram, size in zip(histograms, encoded_bytes):
+        blocks = -(-int(histogram.sum()) // block_size)
+        padding = -(-7 * max(0, blocks - 1) // 8) # Every block but the last, which encoded_size pads already, ends with up to 7 zero bits
+        table_size += padding + (blocks + 1) * tables.narrowest_type([size + padding])[1] # One index entry per block plus the end offset
+
+  # Search for the optimal frequency table and multiplication table with independent seeded restarts
+  # The result only depends on the histograms and the search parameters, unless a time limit cuts the search short
+  with telemetry.phase(hooks, "search", trace_memory=trace_memory):
+    search_key = None
+    if file_cache is not None and time_limit is None:
+      search_key = cache.digest(histograms, json.dumps([list(freq_table.items()), base_size, common_denom, table_size, total_size, strategy, restarts, seed, max_iter]))
+    cached_search = file_cache.load_search(search_key) if search_key is not None else None
+    if cached_search is not None:
+      best_ratio, current_freq_table, current_mult_table, ratios, search_telemetry = cached_search
+      search_telemetry = [dict(record, cached=True) for record in search_telemetry] # Their elapsed times are from the run that searched
+    else:
+      best_ratio, current_freq_table, current_mult_table, ratios, search_telemetry = search.search_tables(
+        histograms, freq_table, base_size, table_size, total_size, strategy=strategy, restarts=restarts,
+        max_iter=max_iter, time_limit=time_limit, seed=seed, workers=workers, common_denom=common_denom)
+      if search_key is not None:
+        file_cache.store_search(search_key, best_ratio, current_freq_table, current_mult_table, ratios, search_telemetry)
+  for record in search_telemetry: # Restarts run in worker processes, so their iterations are reported once the search is done
+    telemetry.emit(hooks, record)
+  missing, collisions = search_telemetry[-1]["missing"], search_telemetry[-1]["collisions"]
+  if missing: # Fail before anything is written rather than write headers that cannot be decoded
+    raise ValueError(f"The search found no tables that give every data element a byte-sized code ({missing} elements left without one); "
+                     "try more restarts or another seed")
+  if collisions: # The decoder maps a shared code to only one of its elements, so the others would not survive the round trip
+    raise ValueError(f"The search found no tables that give every data element its own code ({collisions} elements share one); "
+                     "try more restarts or another seed")
+
+  # Encoding is streamed into the header files so memory stays bounded; the time spent encoding is clocked apart from the writes
+  encode_clock = telemetry.Stopwatch()
+  with telemetry.phase(hooks, "encode", encode_clock, "header_write", trace_memory):
+    # Build the code table of each file once using the best frequency table, the best multiplication table and the base size with variable-length codes
+    # Symbols are visited in order of first occurrence, so a file that cannot be encoded fails on its first bad element before anything is written
+    code_tables = list(encode_clock.timed(create_code_table(current_freq_table, current_mult_table, base_size, order, common_denom) for order in orders))
+
+    # Write the best frequency table, the common denominator, the best multiplication table and the base size to a header file
+    # The multiplication table is stored as the permutations of its rows and columns over the product table
+    defines = {"COMMON_H_DENOM": common_denom, "COMMON_H_BASE_SIZE": base_size, "COMMON_H_KEYS": len(current_freq_table)}
+    os.makedirs(out_dir, exist_ok=True)
+    write_header_file(os.path.join(out_dir, "common.h"), tables.common_arrays("common_h", current_freq_table, current_mult_table), defines)
+
+    # Encode each file in fixed-size blocks and stream the encoded bytes into a separate header file
+    # A cached file whose header still holds the bytes written for the same contents and tables is skipped entirely
+    tables_key = cache.table_digest(current_freq_table, current_mult_table, base_size, common_denom)
+    for file, code_table, histogram, content_key in zip(files, code_tables, histograms, content_keys):
+      header = os.path.join(out_dir, file + ".h")
+      code_key = cache.digest(content_key, tables_key, str(block_size)) if file_cache is not None else None
+      if code_key is not None and file_cache.header_current(code_key, header):
+        continue
+      if block_size is None:
+        encoded_blocks = ((packed, []) for packed in encode_file(os.path.join(dir_name, file), *code_table))
+      else:
+        encoded_blocks = encode_file_blocks(os.path.join(dir_name, file), *code_table, block_size)
+      if code_key is not None:
+        encoded_blocks = file_cache.encoded_blocks(code_key, encoded_blocks)
+      write_data_header_file(header, encode_clock.timed(encoded_blocks), int(histogram.sum()), block_size)
+      if code_key is not None:
+        file_cache.store_header(code_key, header)
+
+  # Round-trip every file through the reference decoder before the headers are used
+  if verify:
+    with telemetry.phase(hooks, "verify", trace_memory=trace_memory):
+      results = decompressor3.verify_dir(dir_name, files, header_dir=out_dir)
+    for result in results: # Report the decode throughput of every file, also when some do not round-trip
+      telemetry.emit(hooks, {"event": "verify", **result})
+    mismatches = [result["file"] for result in results if not result["ok"]]
+    if mismatches:
+      raise ValueError(f"Files do not decode to their original contents: {', '.join(mismatches)}")
+
+  # Return the best compression ratio
+  return best_ratio, ratios
+
+def main(argv=None):
+  # Compress a directory from the command line without any interactive step, so it can run in build pipelines
+  parser = argparse.ArgumentParser(description="Compress every file of a directory into C header files for decompressor3.ino")
+  parser.add_argument("dir_name", nargs="?", default="sample_dir", help="directory whose files are compressed")
+  parser.add_argument("--strategy", default="hill_climb", choices=sorted(search.SEARCH_STRATEGIES), help="table search strategy")
+  parser.add_argument("--restarts", type=int, default=search.SEARCH_RESTARTS, help="number of independent search restarts")
+  parser.add_argument("--seed", type=int, default=0, help="seed of the table search")
+  parser.add_argument("--time-limit", type=float, help="stop the search after this many seconds")
+  parser.add_argument("--max-iter", type=int, help=f"iterations per restart; {MAX_ITER} by default, unlimited with a time limit")
+  parser.add_argument("--workers", type=int, help="number of search processes")
+  parser.add_argument("--block-size", type=int, help="split files into independently decodable blocks of this many bytes")
+  parser.add_argument("--out-dir", default=".", help="directory the header files are written to")
+  parser.add_argument("--verify", action="store_true", help="decode every header file again and compare it with its original file")
+  parser.add_argument("--cache-dir", help="cache directory for incremental recompression")
+  parser.add_argument("--telemetry", help="write the phase and search telemetry as JSON lines to this file, - for standard output")
+  parser.add_argument("--trace-memory", action="store_true", help="also trace the Python memory of every phase, which slows the phases down")
+  parser.add_argument("--plot", action="store_true", help="plot the compression ratio of every search iteration")
+  args = parser.parse_args(argv)
+  if args.restarts < 1: # Checked before any file is read; search_tables rejects it too
+    parser.error(f"--restarts must be at least 1, got {args.restarts}")
+  if args.max_iter is not None and args.max_iter < 1:
+    parser.error(f"--max-iter must be at least 1, got {args.max_iter}")
+  max_iter = args.max_iter if args.max_iter is not None or args.time_limit is not None else MAX_ITER # A time limit alone bounds the search
+
+  hooks = []
+  records = [] # Telemetry kept for the plot
+  telemetry_file = None
+  if args.telemetry == "-":
+    hooks.append(telemetry.JsonLinesWriter(sys.stdout))
+  elif args.telemetry:
+    telemetry_file = open(args.telemetry, "w")
+    hooks.append(telemetry.JsonLinesWriter(telemetry_file))
+  if args.plot:
+    hooks.append(records.append)
+  verified = [] # Verify records, printed once compression is done
+  def collect_verified(record):
+    # Keep the verify records out of the telemetry stream
+    if record["event"] == "verify":
+      verified.append(record)
+  hooks.append(collect_verified)
+
+  try:
+    compression_ratio, ratios = compress_dir(args.dir_name, strategy=args.strategy, restarts=args.restarts, seed=args.seed,
+                                             time_limit=args.time_limit, workers=args.workers, block_size=args.block_size,
+                                             verify=args.verify, cache_dir=args.cache_dir, hooks=hooks, out_dir=args.out_dir, max_iter=max_iter,
+                                             trace_memory=args.trace_memory)
+  finally:
+    if telemetry_file is not None:
+      telemetry_file.close()
+    for result in verified: # Printed even when verification failed, to show which files do not round-trip
+      print(decompressor3.format_result(result), file=sys.stderr if args.telemetry == "-" else sys.stdout)
+
+  # Print the compression ratio
+  print(f"Compression ratio: {compression_ratio:.2f}", file=sys.stderr if args.telemetry == "-" else sys.stdout)
+
+  # Plot the compression ratios for each iteration
+  if args.plot:
+    telemetry.plot_ratios(records)
+
+if __name__ == "__main__":
+  main()
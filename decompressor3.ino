@@ -6,90 +6,106 @@
 
 // Define constants
 #define MAX_FILES 3 // Maximum number of files to decompress
-#define MAX_FILE_SIZE 1024 // Maximum size of each file in bytes
 
-// Define global variables
-int common_denom; // The common denominator for all data
-int base_size; // The custom number base size
+// Read element i of a flash array declared with any of the integer types compressor3.py picks for it
+#define PGM_READ(array, i) (sizeof((array)[0]) == 1 ? (long)pgm_read_byte_near((array) + (i)) : \
+                            sizeof((array)[0]) == 2 ? (long)pgm_read_word_near((array) + (i)) : \
+                                                      (long)pgm_read_dword_near((array) + (i)))
+
+// The compressed files and their decoded lengths
+const uint8_t* const files[MAX_FILES] = {file1_h, file2_h, file3_h};
+const long lengths[MAX_FILES] = {FILE1_H_LENGTH, FILE2_H_LENGTH, FILE3_H_LENGTH};
 
 // Define functions
 void setup() {
   // Initialize serial communication at 9600 bits per second
   Serial.begin(9600);
+}
+
+// Read the bit at position bit_pos of an encoded data array, most significant bit of each byte first
+byte read_bit(const uint8_t* data, long bit_pos) {
+  byte current_byte = pgm_read_byte_near(data + (bit_pos >> 3));
+  return (current_byte >> (7 - (bit_pos & 7))) & 1;
+}
 
-  // Read the common parameters from the common header file
-  common_denom = pgm_read_word_near(common_h); // The first element is the common denominator
-  base_size = pgm_read_word_near(common_h + 1); // The second element is the base size
-  
+// Decode the data element whose code starts at bit_pos and advance bit_pos past the code
+int decode_symbol(const uint8_t* data, long* bit_pos) {
+  int freq = 1;
+  while (read_bit(data, *bit_pos)) { // Read the unary coded frequency up to the zero delimiter
+    freq++;
+    (*bit_pos)++;
+  }
+  (*bit_pos)++; // Skip the delimiter
+
+  int value = 0;
+  for (int b = 0; b < 8; b++) { // Read the encoded value byte
+    value = (value << 1) | read_bit(data, *bit_pos);
+    (*bit_pos)++;
+  }
+
+  // The multiplication table is the product table with permuted rows and columns, so its entries are computed, not stored
+  long row = PGM_READ(common_h_rows, freq - 1) + 1;
+  for (int k = 0; k < COMMON_H_KEYS; k++) { // Find the key with this frequency whose multiplication table entry is the encoded value
+    int key = PGM_READ(common_h_keys, k);
+    if (PGM_READ(common_h_values, k) == freq && row * (PGM_READ(common_h_cols, key % COMMON_H_BASE_SIZE) + 1) == value) {
+      return key * COMMON_H_DENOM;
+    }
+  }
+  return -1; // No key has this code
+}
+
+// Decode block k of a file written in block mode into out and return the number of decoded bytes
+// The block index gives the start byte of every block, so decoding never touches the blocks before block k
+// For example: decode_block(file1_h, PGM_READ(file1_h_index, k), FILE1_H_BLOCK_SIZE, FILE1_H_LENGTH, k, buffer);
+int decode_block(const uint8_t* data, long block_start, int block_size, long length, long k, byte* out) {
+  long bit_pos = block_start * 8; // Jump straight to the first bit of the block
+  long remaining = length - k * block_size;
+  int count = remaining < block_size ? remaining : block_size; // The last block may be shorter
+  for (int j = 0; j < count; j++) {
+    out[j] = decode_symbol(data, &bit_pos);
+  }
+  return count;
 }
 
+#ifdef FILE1_H_BLOCK_SIZE
+// Headers written in block mode pad every block to a whole byte, so their files are decoded block by block through the block indexes
+// compressor3.py writes every file with the same block size
+byte block_buffer[FILE1_H_BLOCK_SIZE]; // Decoded bytes of the current block
+
+// Get the start byte of block k of file i; the index arrays may have different integer types, so each is read on its own
+long block_start(int i, long k) {
+  switch (i) {
+    case 0: return PGM_READ(file1_h_index, k);
+    case 1: return PGM_READ(file2_h_index, k);
+    default: return PGM_READ(file3_h_index, k);
+  }
+}
+#endif
+
 void loop() {
-  
+
   // Decompress each compressed file using the frequency table, the multiplication table and the base size with variable-length codes
   for (int i = 0; i < MAX_FILES; i++) {
-    int index = 0; // Initialize an index variable to keep track of the current position in the compressed file byte array
-    int bit_index = 7; // Initialize a bit index variable to keep track of the current position in the current byte
-    int freq = 0; // Initialize a frequency variable to store the frequency of each data element
-    int mod = 0; // Initialize a modulo variable to store the modulo of each data element
-    
     Serial.print("File ");
     Serial.print(i + 1);
     Serial.print(": ");
-    
-    for (int j = 0; j < MAX_FILE_SIZE; j++) {
-      if (index >= sizeof(file1_h) / sizeof(file1_h[0]) / base_size) { // If reached the end of file1, break out of the loop
-        break;
-      }
-      
-      byte current_byte = pgm_read_byte_near(file1_h + index * base_size); // Get the current byte from file1
-      
-      while (bit_index >= 0) { // Loop over each bit in the current byte
-        
-        if (freq == 0) { // If frequency is zero, read unary code until a zero bit is encountered
-          if (current_byte & (1 << bit_index)) { // If current bit is one, increment frequency
-            freq++;
-          } else { // If current bit is zero, stop reading frequency and read modulo
-            bit_index--; // Decrement bit index
-            break;
-          }
-        } else { // If frequency is non-zero, read modulo as a byte
-          mod = current_byte; // Set modulo to current byte
-          bit_index = -1; // Set bit index to -1 to move to the next byte
-          break;
-        }
-        
-        bit_index--; // Decrement bit index
-      }
-      
-      if (bit_index == -1) { // If bit index is -1, move to the next byte
-        index++; // Increment index
-        bit_index = 7; // Reset bit index to 7
-      }
-      
-      if (freq > 0 && mod > 0) { // If both frequency and modulo are non-zero, decode the data element
-        
-        int mult = pgm_read_word_near(common_h + freq * base_size + mod % base_size + 2 + base_size * 2); 
-// Get the corresponding value from the multiplication table using frequency and modulo
-        
-        for (int k = 0; k < base_size; k++) { // Loop over the keys in the frequency table to find the matching value
-          if (pgm_read_word_near(common_h + k + 2 + base_size) == mult) { 
-// If found a matching value, decode the data element and print it to serial port
-            
-            Serial.print(k * common_denom, HEX); 
-// Multiply the key by the common denominator and print it in hexadecimal format
-            
-            break;
-          }
-        }
-        
-        freq = 0; // Reset frequency to zero
-        mod = 0; // Reset modulo to zero
+
+#ifdef FILE1_H_BLOCK_SIZE
+    for (long k = 0; k * FILE1_H_BLOCK_SIZE < lengths[i]; k++) { // Decode each block from its start in the block index
+      int count = decode_block(files[i], block_start(i, k), FILE1_H_BLOCK_SIZE, lengths[i], k, block_buffer);
+      for (int j = 0; j < count; j++) {
+        Serial.print(block_buffer[j], HEX); // Print each data element in hexadecimal format
       }
     }
-    
-    Serial.println(); 
-// Print a new line
-    
+#else
+    long bit_pos = 0; // Initialize a bit position variable to keep track of the current position in the compressed file
+    for (long j = 0; j < lengths[i]; j++) {
+      Serial.print(decode_symbol(files[i], &bit_pos), HEX); // Decode each data element and print it in hexadecimal format
+    }
+#endif
+
+    Serial.println(); // Print a new line
+
   }
 
   // Stop the loop
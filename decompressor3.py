@@ -0,0 +1,201 @@
+# Host side reader for the header files written by compressor3.py, mirroring decompressor3.ino
+import os
+import re
+import sys
+import argparse
+import time
+import numpy as np
+
+# Define constants
+LOOKUP_BITS = 16 # Number of bits resolved per table lookup (at most 17); codes up to this length decode in one step
+DECODE_CHUNK_SIZE = 1 << 14 # Number of encoded bytes whose windows are computed at once
+
+def read_header_file(filename):
+  # Read the arrays and the numeric defines of a header file written by compressor3.py
+  # Returns a dict of arrays and a dict of defines, both keyed by their C names
+  with open(filename) as f:
+    text = f.read()
+  arrays = {}
+  for name, body in re.findall(r"const\s+[\w ]+?\s+(\w+)\[\]\s*=\s*\{([^}]*)\}", text):
+    arrays[name] = np.array([int(x) for x in body.split(",") if x.strip()], dtype=np.int64)
+  defines = {name: int(value) for name, value in re.findall(r"#define\s+(\w+)\s+(-?\d+)L?\b", text)}
+  return arrays, defines
+
+def load_common(filename="common.h"):
+  # Read the common denominator, the base size, the frequency table and the multiplication table from the common header
+  arrays, defines = read_header_file(filename)
+  name = os.path.basename(filename).replace(".", "_")
+  common_denom, base_size = defines[name.upper() + "_DENOM"], defines[name.upper() + "_BASE_SIZE"]
+  freq_table = dict(zip(arrays[name + "_keys"].tolist(), arrays[name + "_values"].tolist()))
+  mult_table = np.outer(arrays[name + "_rows"] + 1, arrays[name + "_cols"] + 1) # Rows and columns permute the product table
+  return common_denom, base_size, freq_table, mult_table
+
+def create_decode_table(freq_table, mult_table, base_size, common_denom=1):
+  # Map every (frequency, encoded value) code back to its data element
+  # Like decompressor3.ino, the first key in table order wins when two keys share a code
+  decode_table = {}
+  for key, freq in freq_table.items():
+    if freq - 1 < len(mult_table): # Keys with a frequency beyond the table cannot be encoded and have no code
+      decode_table.setdefault((freq, int(mult_table[freq - 1][key % base_size])), key * common_denom)
+  return decode_table
+
+def create_lookup_table(decode_table, lookup_bits=LOOKUP_BITS):
+  # Resolve every lookup_bits wide window of a bit stream to the code that starts it: its length in bits and its data element
+  # A length of 0 marks windows whose code is longer than the window or not in the decode table; those take the slow path
+  windows = np.arange(1 << lookup_bits, dtype=np.int64)
+  ones = np.zeros(len(windows), dtype=np.int64) # Leading ones of every window, the unary coded frequency minus one
+  in_prefix = np.ones(len(windows), dtype=bool)
+  for i in range(lookup_bits):
+    in_prefix &= (windows >> (lookup_bits - 1 - i)) & 1 == 1
+    ones += in_prefix
+  lengths = ones + 9 # Unary prefix, zero delimiter and value byte
+  fits = lengths <= lookup_bits
+  values = (windows >> (lookup_bits - np.minimum(lengths, lookup_bits))) & 0xFF # The value byte ends the code
+
+  # Look the (frequency, value) pairs up in a dense table instead of the dict
+  max_freq = lookup_bits - 8
+  symbol_of = np.full((max_freq + 1, 256), -1, dtype=np.int64)
+  for (freq, value), x in decode_table.items():
+    if freq <= max_freq:
+      symbol_of[freq, value] = x
+  symbols = np.where(fits, symbol_of[np.minimum(ones + 1, max_freq), values], -1)
+  lengths = np.where(symbols >= 0, lengths, 0)
+  return lengths.astype(np.uint8), symbols.astype(np.int16)
+
+def decode_code(data, position, decode_table):
+  # Decode the code starting at bit position of data, for codes the lookup table cannot resolve
+  # The unary coded frequency is counted 64 bits at a time; returns the data element and the bit position just past the code
+  freq = 1
+  while True:
+    offset = position & 7
+    word = int.from_bytes(data[position >> 3:(position >> 3) + 8].ljust(8, b"\0"), "big")
+    word = (word << offset) & 0xFFFFFFFFFFFFFFFF # The bits from position onwards, left aligned
+    ones = 64 - (~word & 0xFFFFFFFFFFFFFFFF).bit_length() # Leading ones of the word
+    freq += min(ones, 64 - offset)
+    position += min(ones, 64 - offset)
+    if ones < 64 - offset: # Found the zero delimiter
+      break
+  value_start = position + 1
+  value = int.from_bytes(data[value_start >> 3:(value_start >> 3) + 2].ljust(2, b"\0"), "big")
+  value = (value >> (8 - (value_start & 7))) & 0xFF # Read the encoded value byte
+  return decode_table[freq, value], value_start + 8
+
+def decode_stream(data, decode_table, lookup_table, count=None, start=0, end=None):
+  # Decode the variable-length codes in data[start:end] with a lookup table from create_lookup_table
+  # Decodes count elements, or every complete code up to the end when count is None (padding is shorter than a code)
+  lookup_lengths, lookup_symbols = lookup_table
+  lookup_bits = len(lookup_lengths).bit_length() - 1
+  data = bytes(data[start:end])
+  last_start = len(data) * 8 - 9 # No code can start after this bit
+  buffer = np.frombuffer(data + bytes(3), dtype=np.uint8).astype(np.int64) # Zero padding so windows can run past the end
+  remaining = len(data) * 8 if count is None else count # Every code takes at least one bit, so this never runs out first
+  decoded = []
+  position = 0
+  while position <= last_start and remaining > 0:
+    # Compute the window starting at every bit of the next chunk: a 24-bit slice from each byte, shifted to each bit offset
+    first_byte = position >> 3
+    last_byte = min(first_byte + DECODE_CHUNK_SIZE, len(data))
+    chunk = buffer[first_byte:last_byte + 2]
+    slices = (chunk[:-2] << 16) | (chunk[1:-1] << 8) | chunk[2:]
+    windows = ((slices[:, None] >> (24 - lookup_bits - np.arange(8))) & ((1 << lookup_bits) - 1)).ravel()
+    base = first_byte * 8
+    stop = min(len(windows), last_start - base + 1) # Relative bit positions at which a code of this chunk can start
+    lengths = lookup_lengths[windows[:stop]].tolist()
+
+    # Follow the chain of code starts through the lookup table; this is the only per-element Python work
+    p = position - base
+    starts = []
+    slow_symbols = {} # Codes the lookup table cannot resolve, decoded bit by bit, by their index in starts
+    while p < stop and remaining > 0:
+      length = lengths[p]
+      starts.append(p)
+      remaining -= 1
+      if length:
+        p += length
+      else:
+        slow_symbols[len(starts) - 1], next_position = decode_code(data, base + p, decode_table)
+        p = next_position - base
+
+    symbols = lookup_symbols[windows[starts]]
+    for i, symbol in slow_symbols.items():
+      symbols[i] = symbol
+    decoded.extend(symbols.tolist())
+    position = base + p
+  return bytes(decoded)
+
+def load_decoder(common_filename="common.h"):
+  # Build the decode table and the lookup table from the common header
+  common_denom, base_size, freq_table, mult_table = load_common(common_filename)
+  decode_table = create_decode_table(freq_table, mult_table, base_size, common_denom)
+  return decode_table, create_lookup_table(decode_table)
+
+def decode_file(filename, decode_table, lookup_table):
+  # Decode a whole header file written by compressor3.py, in stream mode or in block mode
+  arrays, defines = read_header_file(filename)
+  name = os.path.basename(filename).replace(".", "_")
+  data = arrays[name].astype(np.uint8).tobytes()
+  if name + "_index" not in arrays: # Stream mode: one bit stream padded with fewer zero bits than the shortest code
+    return decode_stream(data, decode_table, lookup_table)
+  index, block_size, length = arrays[name + "_index"], defines[name.upper() + "_BLOCK_SIZE"], defines[name.upper() + "_LENGTH"]
+  return b"".join(decode_stream(data, decode_table, lookup_table, min(block_size, length - k * block_size), int(index[k]), int(index[k + 1]))
+                  for k in range(len(index) - 1))
+
+def verify_dir(dir_name, files=None, header_dir=".", common_filename="common.h"):
+  # Decode the header file of every file compressed from dir_name and compare it with the original
+  # Returns one dict per file with whether it round-trips, its size, the decode time and the decode throughput in bytes per second
+  decode_table, lookup_table = load_decoder(os.path.join(header_dir, common_filename))
+  results = []
+  for file in sorted(os.listdir(dir_name)) if files is None else files:
+    with open(os.path.join(dir_name, file), "rb") as f:
+      original = f.read()
+    start_time = time.perf_counter()
+    decoded = decode_file(os.path.join(header_dir, file + ".h"), decode_table, lookup_table)
+    seconds = time.perf_counter() - start_time
+    results.append({"file": file, "ok": decoded == original, "size": len(original), "seconds": seconds,
+                    "throughput": len(original) / seconds if seconds > 0 else float("inf")})
+  return results
+
+class BlockReader:
+  # Random access to a file written by compressor3.py in block mode: block k is decoded without touching any other block
+
+  def __init__(self, filename, common_filename="common.h"):
+    self.decode_table, self.lookup_table = load_decoder(common_filename)
+    arrays, defines = read_header_file(filename)
+    name = os.path.basename(filename).replace(".", "_")
+    self.data = arrays[name].astype(np.uint8).tobytes()
+    self.index = arrays[name + "_index"]
+    self.block_size = defines[name.upper() + "_BLOCK_SIZE"]
+    self.length = defines[name.upper() + "_LENGTH"]
+
+  def __len__(self):
+    # Number of blocks
+    return len(self.index) - 1
+
+  def read_block(self, k):
+    # Decode block k, which holds block_size bytes except for a shorter last block
+    count = min(self.block_size, self.length - k * self.block_size)
+    return decode_stream(self.data, self.decode_table, self.lookup_table, count, int(self.index[k]), int(self.index[k + 1]))
+
+  def read(self, offset, size):
+    # Decode size bytes starting at offset, touching only the blocks that hold them
+    first, last = offset // self.block_size, (offset + size - 1) // self.block_size
+    decoded = b"".join(self.read_block(k) for k in range(first, min(last + 1, len(self))))
+    return decoded[offset - first * self.block_size:][:size]
+
+def format_result(result):
+  # Format one result of verify_dir as a line of text
+  return f"{result['file']}: {'ok' if result['ok'] else 'MISMATCH'}, {result['size']} bytes, {result['throughput'] / 1e6:.2f} MB/s"
+
+def main(argv=None):
+  # Verify the header files in a directory against the files they were compressed from; exits with status 1 on a mismatch
+  parser = argparse.ArgumentParser(description="Decode the header files written by compressor3.py and compare them with their original files")
+  parser.add_argument("dir_name", nargs="?", default="sample_dir", help="directory of the original files")
+  parser.add_argument("--header-dir", default=".", help="directory of the header files, as given to compressor3.py --out-dir")
+  args = parser.parse_args(argv)
+  results = verify_dir(args.dir_name, header_dir=args.header_dir)
+  for result in results:
+    print(format_result(result))
+  return 0 if all(result["ok"] for result in results) else 1
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,55 @@
+# Streaming ingestion for compressor3.py
+# Files are memory mapped as uint8 and processed in fixed-size chunks, and every statistic the compressor needs
+# (size, minimum, maximum, mean, standard deviation, common denominator, frequencies) is derived from one histogram per file,
+# so peak memory stays bounded regardless of the corpus size
+import os
+import math
+import numpy as np
+
+# Define constants
+INGEST_CHUNK_SIZE = 1 << 20 # Number of bytes read, counted and encoded per chunk
+
+def read_chunks(path, chunk_size=INGEST_CHUNK_SIZE):
+  # Yield the bytes of a file as uint8 arrays of at most chunk_size elements without loading the whole file
+  if os.path.getsize(path) == 0: # Empty files cannot be memory mapped
+    return
+  data = np.memmap(path, dtype=np.uint8, mode="r")
+  for start in range(0, len(data), chunk_size):
+    yield data[start:start + chunk_size]
+
+def scan_file(path, chunk_size=INGEST_CHUNK_SIZE):
+  # Count every byte symbol of a file in a single pass
+  # Returns the histogram and the symbols in order of first occurrence, which is the key order create_freq_table produces
+  histogram = np.zeros(256, dtype=np.int64)
+  seen = np.zeros(256, dtype=bool)
+  order = []
+  for chunk in read_chunks(path, chunk_size):
+    counts = np.bincount(chunk, minlength=256)
+    new = (counts > 0) & ~seen
+    if new.any(): # Only chunks that introduce new symbols pay for finding their first positions
+      positions = np.flatnonzero(new[chunk])
+      symbols, first_index = np.unique(chunk[positions], return_index=True)
+      order.extend(symbols[np.argsort(first_index)].tolist())
+      seen |= new
+    histogram += counts
+  return histogram, order
+
+def histogram_stats(histogram):
+  # Get the total size, maximum, minimum, mean and standard deviation of the data described by a histogram
+  present = np.flatnonzero(histogram)
+  total_size = int(histogram.sum())
+  mean_value = float(histogram @ np.arange(256)) / total_size
+  std_value = math.sqrt(float(histogram[present] @ (present - mean_value) ** 2) / total_size)
+  return total_size, int(present.max()), int(present.min()), mean_value, std_value
+
+def histogram_gcd(histogram):
+  # Get the greatest common divisor of all data elements described by a histogram, 1 when every element is zero
+  return math.gcd(*np.flatnonzero(histogram).tolist()) or 1
+
+def freq_table_from_histogram(histogram, order, common_denom):
+  # Create the frequency table of the data described by a histogram, with keys in the given order of byte symbols
+  # Given the order of first occurrence, this is the table create_freq_table builds from the data itself
+  freq_table = {}
+  for x in order:
+    freq_table[x // common_denom] = freq_table.get(x // common_denom, 0) + int(histogram[x]) # Divide each element by the common denominator and count the frequency
+  return freq_table
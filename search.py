@@ -0,0 +1,316 @@
+# Parallel multi-start search for the frequency table and the multiplication table used by compressor3.py
+# Every restart is an independent search with its own seeded random generator, so for a fixed iteration budget
+# the result does not depend on the number of workers or on the order in which the restarts finish
+import os
+import math
+import time
+import random
+import itertools
+from collections import deque, Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import analysis # Histogram-based cost model for the table search
+
+# Define constants
+SEARCH_RESTARTS = 8 # Number of independent restarts of the search
+ANNEAL_START_TEMP = 1e-3 # Starting temperature of simulated annealing, as a fraction of the starting compressed size
+ANNEAL_END_TEMP = 1e-6 # Final temperature of simulated annealing, as a fraction of the starting compressed size
+TABU_TENURE = 16 # Number of iterations a swapped pair of symbols stays forbidden in tabu search
+TABU_CANDIDATES = 8 # Number of neighbors sampled per iteration in tabu search
+
+# Histograms of the files being compressed, set once per worker process by init_worker
+worker_histograms = None
+
+def init_worker(histograms):
+  # Store the histograms in the worker process so they are sent once per worker instead of once per restart
+  global worker_histograms
+  worker_histograms = histograms
+
+class SearchState:
+  # A frequency table as parallel lists of keys and values, and a multiplication table as row and column permutations
+  # of the product table from create_mult_table, together with the encoded bits of every file for those tables
+  # and the codes of every key, to count the keys the tables cannot encode losslessly (see analysis.table_violations)
+
+  def __init__(self, keys, values, row_perm, col_perm, histograms, base_size, common_denom=1):
+    self.keys = keys
+    self.values = values
+    self.row_perm = row_perm
+    self.col_perm = col_perm
+    self.base_size = base_size
+    self.common_denom = common_denom
+    self.freq_of = dict(zip(keys, values))
+    self.code_lengths = analysis.code_length_table(self.freq_of, common_denom)
+    self.file_bits = analysis.encoded_bits(histograms, self.code_lengths)
+    self.pair_counts = Counter() # Number of keys holding every (frequency, encoded value) code
+    self.missing = 0 # Number of keys without a code
+    self.distinct = 0 # Number of distinct codes held by the other keys
+    for key in keys:
+      add_code(self, code_pair(self, key))
+
+  def copy(self):
+    # Copy the state without recomputing the encoded bits or the codes
+    state = SearchState.__new__(SearchState)
+    state.keys = list(self.keys)
+    state.values = list(self.values)
+    state.row_perm = list(self.row_perm)
+    state.col_perm = list(self.col_perm)
+    state.base_size = self.base_size
+    state.common_denom = self.common_denom
+    state.freq_of = dict(self.freq_of)
+    state.code_lengths = self.code_lengths.copy()
+    state.file_bits = self.file_bits.copy()
+    state.pair_counts = Counter(self.pair_counts)
+    state.missing = self.missing
+    state.distinct = self.distinct
+    return state
+
+def code_pair(state, key, freq=None):
+  # Get the code of a key with the current multiplication table, or None when the key has no code
+  return analysis.code_pair(key, state.freq_of[key] if freq is None else freq, state.row_perm, state.col_perm, state.base_size)
+
+def code_changes(state, move):
+  # Get the codes a move replaces, as (old code, new code) pairs; only these codes can add or remove violations
+  choice, i, j = move
+  if choice <= 2: # The two symbols exchange their frequencies
+    a, b = state.keys[i], state.keys[j]
+    return [(code_pair(state, a), code_pair(state, a, state.freq_of[b])), (code_pair(state, b), code_pair(state, b, state.freq_of[a]))]
+  # A row swap moves the codes of the keys with frequency i + 1 or j + 1, a column swap those of the keys in column i or j
+  perm = state.row_perm if choice == 3 else state.col_perm
+  moved = [key for key in state.keys if (state.freq_of[key] - 1 if choice == 3 else key % state.base_size) in (i, j)]
+  old = [code_pair(state, key) for key in moved]
+  perm[i], perm[j] = perm[j], perm[i]
+  new = [code_pair(state, key) for key in moved]
+  perm[i], perm[j] = perm[j], perm[i] # Put the permutation back, apply_move swaps it for good
+  return list(zip(old, new))
+
+def remove_code(state, pair):
+  # Remove one key's code from the code counts
+  if pair is None:
+    state.missing -= 1
+  else:
+    state.pair_counts[pair] -= 1
+    state.distinct -= state.pair_counts[pair] == 0
+
+def add_code(state, pair):
+  # Add one key's code to the code counts
+  if pair is None:
+    state.missing += 1
+  else:
+    state.distinct += state.pair_counts[pair] == 0
+    state.pair_counts[pair] += 1
+
+def replace_codes(state, changes):
+  # Replace the old codes of a move with the new ones
+  for old, new in changes:
+    remove_code(state, old)
+  for old, new in changes:
+    add_code(state, new)
+
+def violations(state):
+  # Get the number of keys without a code and of keys sharing their code with another key, as analysis.table_violations does
+  return state.missing, len(state.keys) - state.missing - state.distinct
+
+def move_violations(state, changes):
+  # Get the violations after a move without applying it
+  replace_codes(state, changes)
+  result = violations(state)
+  replace_codes(state, [(new, old) for old, new in changes]) # Put the code counts back
+  return result
+
+def propose_move(rng, state):
+  # Choose a random neighbor by swapping two keys or values in the frequency table or two rows or columns in the multiplication table
+  choice = rng.randint(1, 4)
+  size = len(state.keys) if choice <= 2 else len(state.row_perm)
+  i, j = rng.sample(range(size), 2)
+  return choice, i, j
+
+def move_delta(state, move, histograms):
+  # Get the change in encoded bits of every file for a move; only frequency swaps change any code length
+  choice, i, j = move
+  if choice <= 2: # Swapping two keys or two values exchanges the frequencies of the two symbols at those positions
+    d = state.common_denom # Keys are byte symbols divided by the common denominator
+    return analysis.swap_delta(histograms, state.code_lengths, state.keys[i] * d, state.keys[j] * d)
+  return None
+
+def apply_move(state, move, delta, changes):
+  # Apply a move to the state in place
+  choice, i, j = move
+  replace_codes(state, changes)
+  swapped = (state.keys[i], state.keys[j]) if choice <= 2 else None # Symbols whose frequencies a frequency swap exchanges
+  if choice == 1:
+    state.keys[i], state.keys[j] = state.keys[j], state.keys[i]
+  elif choice == 2:
+    state.values[i], state.values[j] = state.values[j], state.values[i]
+  elif choice == 3:
+    state.row_perm[i], state.row_perm[j] = state.row_perm[j], state.row_perm[i]
+  else:
+    state.col_perm[i], state.col_perm[j] = state.col_perm[j], state.col_perm[i]
+  if swapped is not None:
+    a, b = swapped
+    state.freq_of[a], state.freq_of[b] = state.freq_of[b], state.freq_of[a]
+  if delta is not None:
+    analysis.swap_code_lengths(state.code_lengths, a * state.common_denom, b * state.common_denom)
+    state.file_bits = state.file_bits + delta
+
+def evaluate_move(state, move, histograms, size_of, current_size):
+  # Score the neighbor a move leads to as (keys without a code, keys sharing a code, compressed size), so tables that
+  # cannot encode every key always rank below lossy ones, and those below lossless ones; also returns what apply_move needs
+  changes = code_changes(state, move)
+  delta = move_delta(state, move, histograms)
+  size = current_size if delta is None else size_of(state.file_bits + delta)
+  return move_violations(state, changes) + (size,), delta, changes
+
+def moved_symbols(state, move):
+  # Get the pair of symbols touched by a frequency swap, used as the tabu attribute
+  choice, i, j = move
+  if choice <= 2:
+    return frozenset((state.keys[i], state.keys[j]))
+  return (choice, frozenset((i, j)))
+
+def iterations(max_iter):
+  # Count the iterations of a strategy: max_iter of them, or without end when only the deadline stops the search
+  return itertools.count() if max_iter is None else range(max_iter)
+
+def search_progress(iteration, max_iter, start_time, deadline):
+  # Get the fraction of the budget of a strategy used so far, from the iteration count or from the time, whichever runs out first
+  progress = 0.0
+  if max_iter is not None:
+    progress = iteration / max(1, max_iter - 1)
+  if deadline is not None:
+    progress = max(progress, (time.time() - start_time) / max(deadline - start_time, 1e-9))
+  return min(progress, 1.0)
+
+def hill_climb(state, rng, histograms, size_of, max_iter, deadline, history):
+  # Greedy hill-climbing: accept a neighbor whenever it is at least as good as the current tables
+  current = violations(state) + (size_of(state.file_bits),)
+  for iteration in iterations(max_iter):
+    if deadline is not None and time.time() >= deadline:
+      break
+    move = propose_move(rng, state)
+    neighbor, delta, changes = evaluate_move(state, move, histograms, size_of, current[-1])
+    accepted = neighbor <= current
+    history.append((iteration, neighbor, move[0], accepted, time.perf_counter()))
+    if accepted:
+      apply_move(state, move, delta, changes)
+      current = neighbor
+  return state
+
+def anneal(state, rng, histograms, size_of, max_iter, deadline, history):
+  # Simulated annealing: accept worse neighbors with a probability that shrinks as the temperature cools geometrically
+  # The temperature follows the used fraction of the budget, so a search bounded by time alone cools exactly by its deadline
+  # Only the compressed size is annealed; a neighbor with more keys without a code or sharing a code is never accepted
+  current = violations(state) + (size_of(state.file_bits),)
+  best = state.copy()
+  best_cost = current
+  start_temp = ANNEAL_START_TEMP * current[-1]
+  start_time = time.time()
+  for iteration in iterations(max_iter):
+    if deadline is not None and time.time() >= deadline:
+      break
+    temp = start_temp * (ANNEAL_END_TEMP / ANNEAL_START_TEMP) ** search_progress(iteration, max_iter, start_time, deadline)
+    move = propose_move(rng, state)
+    neighbor, delta, changes = evaluate_move(state, move, histograms, size_of, current[-1])
+    if neighbor[:2] != current[:2]:
+      accepted = neighbor[:2] < current[:2]
+    else:
+      change = neighbor[2] - current[2]
+      accepted = change <= 0 or rng.random() < math.exp(-change / temp)
+    history.append((iteration, neighbor, move[0], accepted, time.perf_counter()))
+    if accepted:
+      apply_move(state, move, delta, changes)
+      current = neighbor
+      if current < best_cost:
+        best = state.copy()
+        best_cost = current
+  return best
+
+def tabu(state, rng, histograms, size_of, max_iter, deadline, history):
+  # Tabu search: move to the best of several sampled neighbors even if it is worse, but forbid undoing recent swaps
+  current = violations(state) + (size_of(state.file_bits),)
+  best = state.copy()
+  best_cost = current
+  recent = deque(maxlen=TABU_TENURE)
+  for iteration in iterations(max_iter):
+    if deadline is not None and time.time() >= deadline:
+      break
+    chosen = None
+    for candidate in range(TABU_CANDIDATES):
+      move = propose_move(rng, state)
+      neighbor, delta, changes = evaluate_move(state, move, histograms, size_of, current[-1])
+      if moved_symbols(state, move) in recent and neighbor >= best_cost: # Tabu unless it beats the best tables found
+        continue
+      if chosen is None or neighbor < chosen[1]:
+        chosen = move, neighbor, delta, changes
+    if chosen is None: # Every sampled neighbor was tabu
+      continue
+    move, neighbor, delta, changes = chosen
+    history.append((iteration, neighbor, move[0], True, time.perf_counter()))
+    recent.append(moved_symbols(state, move))
+    apply_move(state, move, delta, changes)
+    current = neighbor
+    if current < best_cost:
+      best = state.copy()
+      best_cost = current
+  return best
+
+# Search strategies by name, each taking a starting state and returning the best state it found
+# Every strategy appends one (iteration, (keys without a code, keys sharing a code, neighbor size), move type, accepted, time) entry to history per move it considers
+SEARCH_STRATEGIES = {"hill_climb": hill_climb, "anneal": anneal, "tabu": tabu}
+
+# Names of the move types returned by propose_move, as reported in the search telemetry
+MOVE_TYPES = {1: "swap_keys", 2: "swap_values", 3: "swap_rows", 4: "swap_cols"}
+
+def run_restart(strategy, restart, seed, keys, values, base_size, common_denom, table_size, max_iter, deadline):
+  # Run one restart of a search strategy with its own generator and return only its best candidate
+  histograms = worker_histograms
+  rng = random.Random(f"{seed}:{restart}") # String seeds are hashed deterministically across processes and runs
+  values = list(values)
+  if restart > 0: # The first restart starts from the initial tables, the others from a shuffled frequency table
+    rng.shuffle(values)
+  state = SearchState(list(keys), values, list(range(base_size)), list(range(base_size)), histograms, base_size, common_denom)
+  size_of = lambda file_bits: analysis.encoded_size(file_bits) + table_size
+  history = []
+  start_time = time.perf_counter()
+  best = SEARCH_STRATEGIES[strategy](state, rng, histograms, size_of, max_iter, deadline, history)
+  history = [(iteration, cost, choice, accepted, moment - start_time) for iteration, cost, choice, accepted, moment in history]
+  return violations(best) + (size_of(best.file_bits),), restart, best.keys, best.values, best.row_perm, best.col_perm, history
+
+def search_tables(histograms, freq_table, base_size, table_size, total_size, strategy="hill_climb", restarts=SEARCH_RESTARTS,
+                  max_iter=100, time_limit=None, seed=0, workers=None, common_denom=1):
+  # Search for the frequency table and multiplication table with the best compression ratio, preferring tables that give every key
+  # a code and then tables that give every key its own code (see analysis.table_violations)
+  # Returns the best ratio, the best frequency table, the best multiplication table, the ratio of every iteration of the winning restart
+  # and the telemetry of every restart: one record per iteration with its ratio, violations, move type, acceptance and elapsed seconds,
+  # and a last search record with the violations of the winner, which callers must check before encoding with its tables
+  # Every restart runs max_iter iterations at most and stops at the time limit; with max_iter None only the time limit stops it,
+  # so more workers run more iterations in the same time. Restarts beyond the number of workers wait for a free one within that time
+  if strategy not in SEARCH_STRATEGIES:
+    raise ValueError(f"Unknown search strategy {strategy!r}, expected one of {sorted(SEARCH_STRATEGIES)}")
+  if restarts < 1:
+    raise ValueError(f"The search needs at least one restart, got {restarts}")
+  if max_iter is None and time_limit is None:
+    raise ValueError("The search needs an iteration limit, a time limit or both")
+  if max_iter is not None and max_iter < 1:
+    raise ValueError(f"The search needs at least one iteration, got {max_iter}")
+  deadline = None if time_limit is None else time.time() + time_limit
+  keys, values = list(freq_table.keys()), list(freq_table.values())
+  args = [(strategy, restart, seed, keys, values, base_size, common_denom, table_size, max_iter, deadline) for restart in range(restarts)]
+  workers = min(workers or os.cpu_count() or 1, restarts)
+
+  if workers <= 1: # Run in this process and skip the pool start-up cost
+    init_worker(histograms)
+    results = [run_restart(*arg) for arg in args]
+  else:
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(histograms,)) as executor:
+      results = list(executor.map(run_restart, *zip(*args)))
+
+  # Keep the result with the fewest violations and then the smallest size, breaking ties by restart number so the winner is reproducible
+  (missing, collisions, size), restart, keys, values, row_perm, col_perm, history = min(results, key=lambda result: result[:2])
+  mult_table = np.outer(np.array(row_perm) + 1, np.array(col_perm) + 1)
+  telemetry = [{"event": "iteration", "restart": result[1], "iteration": iteration, "ratio": total_size / s, "missing": m, "collisions": c,
+                "move": MOVE_TYPES[choice], "accepted": accepted, "elapsed": elapsed}
+               for result in results for iteration, (m, c, s), choice, accepted, elapsed in result[6]]
+  telemetry.append({"event": "search", "strategy": strategy, "restart": restart, "ratio": total_size / size,
+                    "missing": missing, "collisions": collisions})
+  ratios = [total_size / s for iteration, (m, c, s), choice, accepted, elapsed in history]
+  return total_size / size, dict(zip(keys, values)), mult_table, ratios, telemetry
@@ -0,0 +1,69 @@
+# Compact C table formats for the header files written by compressor3.py
+# Every array is declared with the narrowest integer type that holds its values, and the multiplication table is stored as
+# permutations of its rows and columns over the implicit product table (i + 1) * (j + 1) from create_mult_table
+import numpy as np
+
+# C integer types from narrowest to widest: name, width in bytes, smallest and largest value
+C_TYPES = [
+  ("uint8_t", 1, 0, 0xFF),
+  ("int8_t", 1, -0x80, 0x7F),
+  ("uint16_t", 2, 0, 0xFFFF),
+  ("int16_t", 2, -0x8000, 0x7FFF),
+  ("uint32_t", 4, 0, 0xFFFFFFFF),
+  ("int32_t", 4, -0x80000000, 0x7FFFFFFF),
+]
+
+def narrowest_type(values):
+  # Get the narrowest C type and its width in bytes for an array of integers
+  values = np.asarray(values, dtype=np.int64)
+  low, high = (int(values.min()), int(values.max())) if len(values) else (0, 0)
+  for ctype, width, type_low, type_high in C_TYPES:
+    if type_low <= low and high <= type_high:
+      return ctype, width
+  raise OverflowError(f"Values from {low} to {high} do not fit a 32-bit C type")
+
+def array_size(values):
+  # Get the size in bytes of an array of integers stored with its narrowest type
+  return len(values) * narrowest_type(values)[1]
+
+def format_values(values):
+  # Format an array of integers as the comma separated body of a C array initializer
+  return ", ".join(map(str, np.asarray(values).tolist()))
+
+def format_array(name, values, progmem=True, progmem_macro=""):
+  # Format a whole C array declaration, typed with the narrowest type, as one string
+  ctype = narrowest_type(values)[0]
+  return (progmem_macro + "\n" if progmem else "") + "const " + ctype + " " + name + "[] = {" + format_values(values) + "};\n\n"
+
+def format_define(name, value):
+  # Format a numeric define
+  return "#define " + name + " " + str(value) + "\n"
+
+def mult_table_perms(mult_table):
+  # Recover the row and column permutations of a multiplication table built by permuting the rows and columns of create_mult_table
+  # Row i is (row_perm[i] + 1) times the permuted column factors, so its sum is (row_perm[i] + 1) * base_size * (base_size + 1) / 2
+  mult_table = np.asarray(mult_table, dtype=np.int64)
+  base_size = len(mult_table)
+  factor_sum = base_size * (base_size + 1) // 2
+  row_perm = mult_table.sum(axis=1) // factor_sum - 1
+  col_perm = mult_table.sum(axis=0) // factor_sum - 1
+  identity = np.arange(base_size)
+  if mult_table.shape != (base_size, base_size) or not (np.sort(row_perm) == identity).all() or not (np.sort(col_perm) == identity).all() \
+     or not (np.outer(row_perm + 1, col_perm + 1) == mult_table).all():
+    raise ValueError("The multiplication table is not a row and column permutation of the product table")
+  return row_perm, col_perm
+
+def common_arrays(name, freq_table, mult_table):
+  # Get the arrays of the common header: frequency table keys and values, and the row and column permutations
+  row_perm, col_perm = mult_table_perms(mult_table)
+  return {
+    name + "_keys": list(freq_table.keys()),
+    name + "_values": list(freq_table.values()),
+    name + "_rows": row_perm,
+    name + "_cols": col_perm,
+  }
+
+def common_size(freq_table, base_size):
+  # Get the size in bytes of the common header arrays; swaps in the search never change it
+  permutation = range(base_size)
+  return array_size(list(freq_table.keys())) + array_size(list(freq_table.values())) + 2 * array_size(permutation)
@@ -0,0 +1,101 @@
+# Instrumentation for compressor3.py
+# A hook is any callable taking one record, a dict whose "event" names its kind: "phase" records carry the wall time and
+# peak resident memory of a pipeline phase, "iteration" records one move of the table search, "search" the winner of the search
+# and "verify" the round trip, decode time and decode throughput of one file
+# Search records replayed from the cache carry "cached": True, their elapsed times are those of the run that searched
+import sys
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+try:
+  import resource # A library for process resource usage, only available on Unix
+except ImportError:
+  resource = None
+
+def emit(hooks, record):
+  # Send a record to every hook
+  for hook in hooks or ():
+    hook(record)
+
+class Stopwatch:
+  # Wall time accumulated over the steps of iterables, for work interleaved with another phase
+
+  def __init__(self):
+    self.seconds = 0.0
+
+  def timed(self, iterable):
+    # Yield the items of an iterable, adding the time spent producing each of them
+    iterator = iter(iterable)
+    while True:
+      start_time = time.perf_counter()
+      try:
+        item = next(iterator)
+      except StopIteration:
+        return
+      finally:
+        self.seconds += time.perf_counter() - start_time
+      yield item
+
+def peak_rss():
+  # Get the peak resident memory in bytes of this process and its finished worker processes so far, or None where it is not available
+  # Unlike traced memory this counts memory-mapped pages and native buffers, and costs nothing while the code runs
+  if resource is None:
+    return None
+  scale = 1 if sys.platform == "darwin" else 1024 # Kilobytes except on macOS
+  return max(resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)) * scale
+
+@contextmanager
+def phase(hooks, name, stopwatch=None, rest=None, trace_memory=False):
+  # Measure the wall time of the code in the with block and emit it as a phase record with the peak resident memory after the block
+  # With a stopwatch the block holds two interleaved phases: name gets the time on the stopwatch and rest the remaining time
+  # With trace_memory the record also holds the peak memory allocated by Python objects during the block, as peak_bytes; tracing
+  # slows every allocation down several times, so timings taken with it are only good for comparing with each other
+  if not hooks:
+    yield
+    return
+  started_tracing = trace_memory and not tracemalloc.is_tracing()
+  if started_tracing:
+    tracemalloc.start()
+  if trace_memory:
+    tracemalloc.reset_peak()
+  start_time = time.perf_counter()
+  try:
+    yield
+  finally:
+    seconds = time.perf_counter() - start_time
+    memory = {"peak_rss": peak_rss()}
+    if trace_memory:
+      memory["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+    if started_tracing:
+      tracemalloc.stop()
+    if stopwatch is None:
+      emit(hooks, {"event": "phase", "phase": name, "seconds": seconds, **memory})
+    else:
+      emit(hooks, {"event": "phase", "phase": name, "seconds": stopwatch.seconds, **memory})
+      emit(hooks, {"event": "phase", "phase": rest, "seconds": seconds - stopwatch.seconds, **memory})
+
+class JsonLinesWriter:
+  # A hook writing every record as one line of JSON to a file, flushed so the stream can be followed while the compressor runs
+
+  def __init__(self, f=sys.stdout):
+    self.f = f
+
+  def __call__(self, record):
+    self.f.write(json.dumps(record) + "\n")
+    self.f.flush()
+
+def read_json_lines(f):
+  # Read the records written by JsonLinesWriter back from a file
+  return [json.loads(line) for line in f if line.strip()]
+
+def plot_ratios(records):
+  # Plot the compression ratio of every iteration of the winning restart from a telemetry stream
+  import matplotlib.pyplot as plt # A library for plotting, only needed when plotting
+  records = list(records)
+  winner = [record["restart"] for record in records if record["event"] == "search"][-1]
+  plt.plot([record["ratio"] for record in records if record["event"] == "iteration" and record["restart"] == winner])
+  plt.xlabel("Iteration")
+  plt.ylabel("Compression ratio")
+  plt.title("Compression ratio vs. iteration")
+  plt.show()
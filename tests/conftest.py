@@ -0,0 +1,24 @@
+# Shared setup for the tests of the compressor and the decoder
+import os
+import sys
+import pytest
+
+# The modules live at the top of the repository, so make them importable however pytest is started
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Small files the compressor can encode losslessly: with these the search finds tables without missing or shared codes
+SAMPLE_FILES = {
+  "file1": bytes([5, 13, 21, 2, 3, 27]),
+  "file2": bytes([4, 12, 19, 2, 17, 7, 2, 3, 14]),
+  "file3": bytes([3, 8, 3, 18, 14, 2, 27]),
+  "file4": bytes([4, 8, 21, 21, 19, 2, 19, 19, 13, 2]),
+}
+
+@pytest.fixture
+def sample_dir(tmp_path):
+  # Write the sample files to a fresh directory and return its path
+  dir_name = tmp_path / "sample_dir"
+  dir_name.mkdir()
+  for name, data in SAMPLE_FILES.items():
+    (dir_name / name).write_bytes(data)
+  return str(dir_name)
@@ -0,0 +1,11 @@
+# Tests of the benchmark baseline comparison
+import benchmark
+
+def test_compare_gates_every_benchmark():
+  # A slower benchmark counts as a regression even when it reports no throughput
+  baseline = {"text-1K": {"create_mult_table": {"seconds": 1.0, "base_size": 15}, "write_header_file": {"seconds": 1.0},
+                          "search": {"seconds": 1.0, "iterations_per_second": 100.0, "model_ratio": 2.0}, "peak_rss": 100}}
+  results = {"text-1K": {"create_mult_table": {"seconds": 1.5, "base_size": 15}, "write_header_file": {"seconds": 0.5},
+                         "search": {"seconds": 1.0, "iterations_per_second": 100.0, "model_ratio": 1.0}, "peak_rss": 100}}
+  regressions = benchmark.compare(results, baseline)
+  assert len(regressions) == 1 and regressions[0].startswith("text-1K create_mult_table seconds")
@@ -0,0 +1,64 @@
+# Tests of incremental recompression with the on-disk cache
+import os
+import pytest
+import compressor3
+import ingest
+
+@pytest.fixture
+def counted(monkeypatch):
+  # Count the files scanned and encoded by compress_dir
+  counts = {"scan": [], "encode": []}
+  scan_file, encode_file = ingest.scan_file, compressor3.encode_file
+  def counted_scan(path, *args):
+    counts["scan"].append(os.path.basename(path))
+    return scan_file(path, *args)
+  def counted_encode(path, *args):
+    counts["encode"].append(os.path.basename(path))
+    return encode_file(path, *args)
+  monkeypatch.setattr(ingest, "scan_file", counted_scan)
+  monkeypatch.setattr(compressor3, "encode_file", counted_encode)
+  return counts
+
+def compress(sample_dir, tmp_path, **kwargs):
+  # Compress the sample files with the cache in tmp_path and check the round trip
+  return compressor3.compress_dir(sample_dir, workers=1, verify=True, cache_dir=str(tmp_path / "cache"), out_dir=str(tmp_path / "out"), **kwargs)
+
+def test_unchanged_files_are_skipped(sample_dir, tmp_path, counted):
+  # A rerun with nothing changed neither scans nor encodes any file, and leaves the headers alone
+  compress(sample_dir, tmp_path)
+  assert sorted(counted["scan"]) == sorted(counted["encode"]) == sorted(os.listdir(sample_dir))
+  modified = {name: os.stat(tmp_path / "out" / name).st_mtime_ns for name in os.listdir(tmp_path / "out")}
+  counted["scan"].clear()
+  counted["encode"].clear()
+  compress(sample_dir, tmp_path)
+  assert counted["scan"] == counted["encode"] == []
+  assert {name: os.stat(tmp_path / "out" / name).st_mtime_ns for name in os.listdir(tmp_path / "out")} == modified
+
+def test_reordered_file_is_the_only_one_encoded(sample_dir, tmp_path, counted):
+  # Swapping two bytes keeps the histograms and so the tables; only the changed file is scanned and encoded again
+  compress(sample_dir, tmp_path)
+  path = os.path.join(sample_dir, "file2")
+  data = bytearray(open(path, "rb").read())
+  data[0], data[1] = data[1], data[0]
+  with open(path, "wb") as f:
+    f.write(data)
+  counted["scan"].clear()
+  counted["encode"].clear()
+  compress(sample_dir, tmp_path)
+  assert counted["scan"] == counted["encode"] == ["file2"]
+
+def test_identical_files_keep_their_headers(sample_dir, tmp_path, counted):
+  # Files with the same contents share their encoding but not their header entries
+  with open(os.path.join(sample_dir, "file1"), "rb") as f, open(os.path.join(sample_dir, "file5"), "wb") as copy:
+    copy.write(f.read())
+  compress(sample_dir, tmp_path)
+  counted["encode"].clear()
+  compress(sample_dir, tmp_path)
+  assert counted["encode"] == []
+
+def test_eviction_keeps_the_cache_small(sample_dir, tmp_path):
+  # A tiny cache evicts old entries but compression still round-trips, on the first run and on reruns
+  for run in range(3):
+    compress(sample_dir, tmp_path, cache_max_bytes=600)
+    cache_bytes = sum(entry.stat().st_size for entry in os.scandir(tmp_path / "cache"))
+    assert cache_bytes <= 600
@@ -0,0 +1,46 @@
+# End-to-end tests of compress_dir on the sample files
+import os
+import pytest
+import compressor3
+import decompressor3
+import ingest
+import tables # Compact C table formats for the header files
+from conftest import SAMPLE_FILES
+
+def read_headers(out_dir):
+  # Get the bytes of every header file in a directory by name
+  return {name: open(os.path.join(out_dir, name), "rb").read() for name in sorted(os.listdir(out_dir))}
+
+def test_listing_order_does_not_change_output(sample_dir, tmp_path, monkeypatch):
+  # The same files listed in another order give byte-identical headers
+  compressor3.compress_dir(sample_dir, workers=1, verify=True, out_dir=str(tmp_path / "sorted"))
+  listdir = os.listdir
+  monkeypatch.setattr(os, "listdir", lambda path: sorted(listdir(path), reverse=True))
+  compressor3.compress_dir(sample_dir, workers=1, verify=True, out_dir=str(tmp_path / "reversed"))
+  assert read_headers(str(tmp_path / "sorted")) == read_headers(str(tmp_path / "reversed"))
+
+def test_verify_reports_throughput(sample_dir, tmp_path, capsys):
+  # Verification sends the decode throughput of every file to the hooks, and the decoder finds headers in any directory
+  records = []
+  compressor3.compress_dir(sample_dir, workers=1, verify=True, out_dir=str(tmp_path / "out"), hooks=[records.append])
+  verified = [record for record in records if record["event"] == "verify"]
+  assert sorted(record["file"] for record in verified) == sorted(os.listdir(sample_dir))
+  assert all(record["ok"] and record["throughput"] > 0 for record in verified)
+  assert decompressor3.main([sample_dir, "--header-dir", str(tmp_path / "out")]) == 0
+  assert capsys.readouterr().out.count(": ok,") == len(verified)
+
+@pytest.mark.parametrize("block_size", [1, 2, 5])
+def test_block_mode_ratio_is_not_optimistic(sample_dir, tmp_path, block_size):
+  # The ratio the search reports counts the block padding and the index, so it never exceeds the ratio of the written headers
+  ratio, ratios = compressor3.compress_dir(sample_dir, workers=1, verify=True, block_size=block_size, out_dir=str(tmp_path / "out"))
+  header_bytes = 0
+  for name in os.listdir(tmp_path / "out"):
+    arrays, defines = decompressor3.read_header_file(os.path.join(tmp_path, "out", name))
+    header_bytes += sum(tables.array_size(values) for values in arrays.values())
+  assert ratio <= sum(len(data) for data in SAMPLE_FILES.values()) / header_bytes
+
+def test_block_index_spans_chunks(sample_dir, tmp_path, monkeypatch):
+  # The spilled block index is read back in several chunks, on a cache miss and on a cache hit
+  monkeypatch.setattr(ingest, "INGEST_CHUNK_SIZE", 16)
+  for run in range(2):
+    compressor3.compress_dir(sample_dir, workers=1, verify=True, block_size=1, out_dir=str(tmp_path / "out"), cache_dir=str(tmp_path / "cache"))
@@ -0,0 +1,32 @@
+# Compare the memoized cyclotomic coefficients and their Horner evaluation with sympy
+import numpy as np
+import pytest
+import sympy # A library for symbolic mathematics
+import compressor3
+
+X = sympy.Symbol('x')
+
+def sympy_value(n, x):
+  # Evaluate the n-th cyclotomic polynomial at x with sympy
+  return int(sympy.cyclotomic_poly(n, X).subs(X, x))
+
+@pytest.mark.parametrize("n", [1, 2, 3, 5, 12, 30, 105])
+@pytest.mark.parametrize("x", [0, 1, -1, 2, 7, -13, 255, 2 ** 20, 2 ** 63, 2 ** 70, -2 ** 70])
+def test_scalar(n, x):
+  # Scalars give Python integers, also past 64 bits
+  value = compressor3.evaluate_poly(compressor3.cyclotomic_poly(n), x)
+  assert type(value) is int and value == sympy_value(n, x)
+
+@pytest.mark.parametrize("n", [1, 6, 15, 105])
+def test_array(n):
+  # Arrays are evaluated element by element, in int64 when the values fit and with Python integers otherwise
+  poly = compressor3.cyclotomic_poly(n)
+  for values in [np.arange(-20, 300), np.array([2 ** 62, 3, -2 ** 63], dtype=np.int64), np.array([2 ** 64 - 1, 5], dtype=np.uint64),
+                 np.array([2 ** 70, -5], dtype=object)]:
+    assert [int(v) for v in compressor3.evaluate_poly(poly, values)] == [sympy_value(n, int(x)) for x in values.tolist()]
+
+@pytest.mark.parametrize("x", [1.7, np.array([1.0, 2.0]), True, np.array([1.5], dtype=object)])
+def test_rejects_non_integers(x):
+  # Floats would be truncated, so they are rejected
+  with pytest.raises(TypeError):
+    compressor3.evaluate_poly(compressor3.cyclotomic_poly(3), x)
@@ -0,0 +1,66 @@
+# Round-trip header files written by compressor3.py through the lookup-table decoder of decompressor3.py
+import os
+import numpy as np
+import pytest
+import compressor3
+import decompressor3
+import tables # Compact C table formats for the header files
+
+# Define constants
+BASE_SIZE = 16 # Base size of the test tables
+FREQ_TABLE = {x: 1 + x * 7 % 12 for x in range(BASE_SIZE)} # Every key has its own column, so no two keys share a code; frequencies up to 12 give codes longer than LOOKUP_BITS
+
+def write_headers(out_dir, data, block_size=None, common_denom=1):
+  # Write the common header and the header of one file holding data, and return the path of the data header
+  mult_table = compressor3.create_mult_table(BASE_SIZE)
+  defines = {"COMMON_H_DENOM": common_denom, "COMMON_H_BASE_SIZE": BASE_SIZE, "COMMON_H_KEYS": len(FREQ_TABLE)}
+  compressor3.write_header_file(os.path.join(out_dir, "common.h"), tables.common_arrays("common_h", FREQ_TABLE, mult_table), defines)
+  path = os.path.join(out_dir, "data")
+  with open(path, "wb") as f:
+    f.write(data)
+  code_table = compressor3.create_code_table(FREQ_TABLE, mult_table, BASE_SIZE, common_denom=common_denom)
+  if block_size is None:
+    encoded_blocks = ((packed, []) for packed in compressor3.encode_file(path, *code_table))
+  else:
+    encoded_blocks = compressor3.encode_file_blocks(path, *code_table, block_size)
+  compressor3.write_data_header_file(path + ".h", encoded_blocks, len(data), block_size)
+  return path + ".h"
+
+def random_data(seed, size, common_denom=1):
+  # Random elements of the frequency table, as byte symbols
+  rng = np.random.default_rng(seed)
+  return (rng.integers(0, BASE_SIZE, size) * common_denom).astype(np.uint8).tobytes()
+
+@pytest.mark.parametrize("block_size", [None, 1, 7, 64])
+@pytest.mark.parametrize("size", [0, 1, 1000])
+def test_round_trip(tmp_path, block_size, size):
+  # Stream and block mode headers decode to the original bytes, including codes the lookup table cannot resolve
+  data = random_data(size, size)
+  header = write_headers(str(tmp_path), data, block_size)
+  decode_table, lookup_table = decompressor3.load_decoder(os.path.join(str(tmp_path), "common.h"))
+  assert decompressor3.decode_file(header, decode_table, lookup_table) == data
+
+def test_round_trip_common_denominator(tmp_path):
+  # Keys are symbols divided by the common denominator, which the decoder multiplies back
+  data = random_data(1, 500, common_denom=4)
+  header = write_headers(str(tmp_path), data, common_denom=4)
+  decode_table, lookup_table = decompressor3.load_decoder(os.path.join(str(tmp_path), "common.h"))
+  assert decompressor3.decode_file(header, decode_table, lookup_table) == data
+
+def test_verify_dir(tmp_path):
+  # verify_dir reads the headers from their own directory
+  data = random_data(2, 300)
+  write_headers(str(tmp_path), data, block_size=32)
+  [result] = decompressor3.verify_dir(str(tmp_path), ["data"], header_dir=str(tmp_path))
+  assert result["ok"] and result["size"] == len(data)
+
+def test_block_reader(tmp_path):
+  # Every block and every byte range decode on their own, including a shorter last block
+  data = random_data(3, 1000)
+  header = write_headers(str(tmp_path), data, block_size=48)
+  reader = decompressor3.BlockReader(header, os.path.join(str(tmp_path), "common.h"))
+  assert len(reader) == -(-len(data) // 48)
+  for k in range(len(reader)):
+    assert reader.read_block(k) == data[k * 48:(k + 1) * 48]
+  for offset, size in [(0, 1), (47, 2), (100, 300), (990, 10), (0, len(data)), (995, 100)]:
+    assert reader.read(offset, size) == data[offset:offset + size]
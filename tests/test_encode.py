@@ -0,0 +1,81 @@
+# Compare the bulk bit packer of compressor3.py with the original per-symbol encoding loop
+import numpy as np
+import pytest
+import bitarray # A library for manipulating bit arrays
+import compressor3
+
+def reference_encode(data, freq_table, mult_table, base_size):
+  # Encode one symbol at a time, as encode_data did before the bulk packer
+  encoded_data = bitarray.bitarray()
+  for x in data:
+    freq = freq_table[x] # Get the frequency of the data element
+    mult = mult_table[freq - 1] # Get the corresponding row in the multiplication table
+    encoded_value = int(mult[x % base_size]) # Get the encoded value from the multiplication table
+    encoded_bits = bitarray.bitarray()
+    encoded_bits.extend('1' * (freq - 1)) # Unary coded frequency
+    encoded_bits.append(0) # Delimiter
+    encoded_bits.frombytes(encoded_value.to_bytes(1, 'big')) # Encoded value byte
+    encoded_data.extend(encoded_bits)
+  return encoded_data
+
+def raised(encode, *args):
+  # Get the type and arguments of the exception an encoder raises, or None when it succeeds
+  try:
+    encode(*args)
+  except (KeyError, IndexError, OverflowError) as e:
+    return type(e), e.args
+  return None
+
+def test_empty_input():
+  # Nothing to encode gives an empty bit array
+  freq_table = {x: 1 for x in range(16)}
+  mult_table = compressor3.create_mult_table(16)
+  assert compressor3.encode_data(b"", freq_table, mult_table, 16) == reference_encode(b"", freq_table, mult_table, 16) == bitarray.bitarray()
+
+@pytest.mark.parametrize("seed", range(5))
+def test_codes_spilling_across_words(seed):
+  # Codes of 9 to 23 bits start at every offset of the output words, so many of them cross a word boundary
+  rng = np.random.default_rng(seed)
+  freq_table = {x: int(rng.integers(1, 16)) for x in range(64)}
+  mult_table = compressor3.create_mult_table(16)
+  data = rng.integers(0, 64, 5000, dtype=np.uint8).tobytes()
+  assert compressor3.encode_data(data, freq_table, mult_table, 16) == reference_encode(data, freq_table, mult_table, 16)
+
+def test_blocks_join_at_bit_granularity(monkeypatch):
+  # Blocks of the bulk packer end inside a byte and are joined without padding
+  monkeypatch.setattr(compressor3, "PACK_BLOCK_SIZE", 7)
+  freq_table = {x: x % 5 + 1 for x in range(32)}
+  mult_table = compressor3.create_mult_table(16)
+  data = bytes(range(32)) * 3
+  assert compressor3.encode_data(data, freq_table, mult_table, 16) == reference_encode(data, freq_table, mult_table, 16)
+
+def test_codes_longer_than_a_word():
+  # A unary prefix of 69 ones makes a 78-bit code, which the word packer cannot hold, mixed with short codes
+  freq_table = {0: 70, 1: 1, 2: 3, 3: 64}
+  mult_table = np.ones((70, 4), dtype=np.int64) * np.arange(1, 5)
+  data = bytes([1, 0, 2, 3, 0, 1, 1, 2, 0])
+  assert compressor3.encode_data(data, freq_table, mult_table, 4) == reference_encode(data, freq_table, mult_table, 4)
+
+@pytest.mark.parametrize("data", [
+  bytes([0, 1, 9]), # No key
+  bytes([0, 2, 1]), # Frequency beyond the rows of the multiplication table
+  bytes([1, 0, 3]), # Encoded value above one byte
+  bytes([1, 3, 9, 2]), # The first element that cannot be encoded decides the error
+  bytes([1, 9, 3, 2]),
+  bytes([2, 9, 3]),
+])
+def test_error_parity(data):
+  # The bulk packer raises the same error as the per-symbol loop for the first element that cannot be encoded
+  freq_table = {0: 1, 1: 2, 2: 5, 3: 4}
+  mult_table = np.array([[1, 2, 3, 4], [2, 4, 6, 8], [3, 6, 9, 12], [64, 128, 192, 256]])
+  error = raised(reference_encode, data, freq_table, mult_table, 4)
+  assert error is not None
+  assert raised(compressor3.encode_data, data, freq_table, mult_table, 4) == error
+
+def test_pack_rejects_symbols_without_code():
+  # A code table built for some symbols only cannot pack the others
+  prefix_lengths, code_values = compressor3.create_code_table({0: 1, 1: 2}, compressor3.create_mult_table(4), 4, [0, 1])
+  with pytest.raises(KeyError):
+    compressor3.pack_codes(np.array([0, 5, 1], dtype=np.uint8), prefix_lengths, code_values)
+  with pytest.raises(KeyError):
+    compressor3.pack_blocks(np.array([0, 1, 7], dtype=np.uint8), prefix_lengths, code_values, 2)
@@ -0,0 +1,49 @@
+# Compare the histogram-based statistics of the streaming ingestion with the list-based ones they replace
+import math
+import numpy as np
+import pytest
+import compressor3
+import ingest
+
+def corpus(seed):
+  # A few files of random bytes, some sharing a common denominator
+  rng = np.random.default_rng(seed)
+  step = [1, 2, 3, 8][seed % 4]
+  return [(rng.integers(0, 256 // step, int(rng.integers(1, 3000))) * step).astype(np.uint8).tobytes() for file in range(int(rng.integers(1, 4)))]
+
+def scan(tmp_path, data_list, chunk_size):
+  # Scan every file of a corpus and return the histograms and the first occurrence orders
+  scans = []
+  for i, data in enumerate(data_list):
+    path = tmp_path / f"file{i}"
+    path.write_bytes(data)
+    scans.append(ingest.scan_file(str(path), chunk_size))
+  return [histogram for histogram, order in scans], [order for histogram, order in scans]
+
+@pytest.mark.parametrize("seed", range(8))
+@pytest.mark.parametrize("chunk_size", [7, 1 << 20])
+def test_matches_list_statistics(tmp_path, seed, chunk_size):
+  # Size, extremes, mean, standard deviation, common denominator and frequency table agree with the lists of bytes
+  data_list = corpus(seed)
+  histograms, orders = scan(tmp_path, data_list, chunk_size)
+  data = [x for file_data in data_list for x in file_data]
+  histogram = np.sum(histograms, axis=0)
+
+  total_size, max_value, min_value, mean_value, std_value = ingest.histogram_stats(histogram)
+  assert (total_size, max_value, min_value) == (len(data), max(data), min(data))
+  assert mean_value == pytest.approx(sum(data) / len(data))
+  assert std_value == pytest.approx(math.sqrt(sum((x - sum(data) / len(data)) ** 2 for x in data) / len(data)))
+
+  freq_table, common_denom = compressor3.create_freq_table(data)
+  assert ingest.histogram_gcd(histogram) == common_denom
+  for file_data, order in zip(data_list, orders): # Every file lists its symbols in order of first occurrence
+    assert order == list(dict.fromkeys(file_data))
+  first_order = list(dict.fromkeys(data))
+  assert list(ingest.freq_table_from_histogram(histogram, first_order, common_denom).items()) == list(freq_table.items())
+
+def test_all_zero_data():
+  # Data of zeros only has no common divisor, so the denominator falls back to 1
+  histogram = np.zeros(256, dtype=np.int64)
+  histogram[0] = 5
+  assert ingest.histogram_gcd(histogram) == 1
+  assert ingest.histogram_stats(histogram)[:3] == (5, 0, 0)
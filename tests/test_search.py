@@ -0,0 +1,55 @@
+# Tests of the table search
+import random
+import numpy as np
+import pytest
+import analysis
+import search
+
+def search_inputs():
+  # Histograms of two files and the frequency table of their keys
+  rng = np.random.default_rng(0)
+  histograms = np.zeros((2, 256), dtype=np.int64)
+  histograms[:, :20] = rng.integers(0, 5, (2, 20))
+  freq_table = {x: 1 + x % 4 for x in range(20)}
+  return histograms, freq_table
+
+@pytest.mark.parametrize("strategy", sorted(search.SEARCH_STRATEGIES))
+def test_time_limit_without_iteration_limit(strategy):
+  # With max_iter None the search runs past the default iteration budget until the time limit
+  histograms, freq_table = search_inputs()
+  ratio, freq, mult, ratios, telemetry = search.search_tables(histograms, freq_table, 8, 0, 100, strategy=strategy, restarts=1,
+                                                              max_iter=None, time_limit=0.2, workers=1)
+  iterations = [record for record in telemetry if record["event"] == "iteration"]
+  assert len(iterations) > 100
+  assert iterations[-1]["elapsed"] < 1.0
+
+def test_search_needs_a_limit():
+  # Without any limit the search would never stop
+  histograms, freq_table = search_inputs()
+  with pytest.raises(ValueError):
+    search.search_tables(histograms, freq_table, 8, 0, 100, max_iter=None, workers=1)
+  with pytest.raises(ValueError):
+    search.search_tables(histograms, freq_table, 8, 0, 100, max_iter=0, workers=1)
+  with pytest.raises(ValueError):
+    search.search_tables(histograms, freq_table, 8, 0, 100, restarts=0, workers=1)
+
+@pytest.mark.parametrize("seed", range(10))
+@pytest.mark.parametrize("common_denom", [1, 3])
+def test_incremental_bookkeeping(seed, common_denom):
+  # After any sequence of moves the state's codes and encoded bits match a computation from scratch
+  rng = np.random.default_rng(seed)
+  base_size = int(rng.integers(3, 12))
+  keys = list(range(int(rng.integers(3, 256 // common_denom))))
+  values = [int(v) for v in rng.integers(1, base_size + 2, len(keys))]
+  histograms = np.zeros((3, 256), dtype=np.int64)
+  histograms[:, [key * common_denom for key in keys]] = rng.integers(0, 20, (3, len(keys)))
+  state = search.SearchState(keys, values, list(range(base_size)), list(range(base_size)), histograms, base_size, common_denom)
+  move_rng = random.Random(seed)
+  for iteration in range(300):
+    move = search.propose_move(move_rng, state)
+    cost, delta, changes = search.evaluate_move(state, move, histograms, lambda file_bits: int(file_bits.sum()), int(state.file_bits.sum()))
+    search.apply_move(state, move, delta, changes)
+    freq_table = dict(zip(state.keys, state.values))
+    assert search.violations(state) == analysis.table_violations(freq_table, state.row_perm, state.col_perm, base_size) == cost[:2]
+    assert (state.file_bits == analysis.encoded_bits(histograms, analysis.code_length_table(freq_table, common_denom))).all()
+    assert cost[2] == int(state.file_bits.sum())
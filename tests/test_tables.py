@@ -0,0 +1,53 @@
+# Tests of the compact C table formats
+import numpy as np
+import pytest
+import compressor3
+import tables # Compact C table formats for the header files
+
+@pytest.mark.parametrize("base_size", [1, 2, 7, 16, 256])
+def test_mult_table_perms_round_trip(base_size):
+  # The permutations recovered from a permuted product table rebuild it exactly
+  rng = np.random.default_rng(base_size)
+  row_perm, col_perm = rng.permutation(base_size), rng.permutation(base_size)
+  mult_table = compressor3.create_mult_table(base_size)[row_perm][:, col_perm]
+  rows, cols = tables.mult_table_perms(mult_table)
+  assert (rows == row_perm).all() and (cols == col_perm).all()
+  assert (np.outer(rows + 1, cols + 1) == mult_table).all()
+
+@pytest.mark.parametrize("mult_table", [
+  np.outer([1, 2, 3], [2, 2, 2]), # Products, but the columns are not a permutation
+  np.outer([2, 2, 2], [1, 2, 3]), # Products, but the rows are not a permutation
+  compressor3.create_mult_table(3) + np.eye(3, dtype=int), # Not a product table
+  np.outer([1, 2, 3], [1, 2]), # Not square
+  np.zeros((3, 3), dtype=int),
+])
+def test_mult_table_perms_rejects_other_tables(mult_table):
+  # Only row and column permutations of the product table can be stored as permutations
+  with pytest.raises(ValueError):
+    tables.mult_table_perms(mult_table)
+
+@pytest.mark.parametrize("values, ctype", [
+  ([], "uint8_t"),
+  ([0, 255], "uint8_t"),
+  ([256], "uint16_t"),
+  ([-1, 127], "int8_t"),
+  ([-1, 128], "int16_t"),
+  ([-128], "int8_t"),
+  ([-129], "int16_t"),
+  ([65535], "uint16_t"),
+  ([65536], "uint32_t"),
+  ([-32768, 32767], "int16_t"),
+  ([-32769], "int32_t"),
+  ([-1, 32768], "int32_t"),
+  ([2 ** 32 - 1], "uint32_t"),
+  ([-2 ** 31, 2 ** 31 - 1], "int32_t"),
+])
+def test_narrowest_type_boundaries(values, ctype):
+  # The narrowest type changes exactly where the values stop fitting
+  assert tables.narrowest_type(values)[0] == ctype
+
+@pytest.mark.parametrize("values", [[2 ** 32], [-2 ** 31 - 1], [-1, 2 ** 31]])
+def test_narrowest_type_overflow(values):
+  # Values beyond 32 bits have no C type in the headers
+  with pytest.raises(OverflowError):
+    tables.narrowest_type(values)
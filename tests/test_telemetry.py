@@ -0,0 +1,24 @@
+# Tests of the phase timers
+import tracemalloc
+import telemetry
+
+def test_phase_is_untraced_by_default():
+  # Timings are taken without allocation tracing unless memory tracing is asked for
+  records = []
+  with telemetry.phase([records.append], "work"):
+    assert not tracemalloc.is_tracing()
+  with telemetry.phase([records.append], "traced", trace_memory=True):
+    assert tracemalloc.is_tracing()
+    data = bytearray(1 << 20)
+  assert not tracemalloc.is_tracing()
+  assert "peak_bytes" not in records[0] and records[0]["peak_rss"] > 0
+  assert records[1]["peak_bytes"] >= 1 << 20
+
+def test_stopwatch_splits_phases():
+  # A stopwatch phase reports the clocked time and the rest of the block as two records
+  records = []
+  clock = telemetry.Stopwatch()
+  with telemetry.phase([records.append], "encode", clock, "write"):
+    list(clock.timed(range(3)))
+  assert [record["phase"] for record in records] == ["encode", "write"]
+  assert records[0]["seconds"] + records[1]["seconds"] >= 0